@@ -0,0 +1,35 @@
+from typing import Tuple
+
+import supervisely as sly
+
+
+class AnnotationBuilder:
+    """Collects labels and image tags of merged parts, sly.Annotation is created once in `build`.
+
+    Tags are deduplicated by name like TagCollection.merge_without_duplicates: equal tags are
+    added once, tags with the same name and different values raise ValueError.
+    """
+
+    def __init__(self, img_size: Tuple[int, int]):
+        self.img_size = img_size
+        self._labels = []
+        self._tags = {}
+
+    def __len__(self):
+        return len(self._labels)
+
+    def add(self, ann: sly.Annotation):
+        self._labels.extend(ann.labels)
+        for tag in ann.img_tags:
+            our_tag = self._tags.get(tag.key())
+            if our_tag is None:
+                self._tags[tag.key()] = tag
+            elif our_tag != tag:
+                raise ValueError(
+                    "Error during merge for key {!r}: values are different".format(tag.key())
+                )
+
+    def build(self) -> sly.Annotation:
+        return sly.Annotation(
+            self.img_size, labels=self._labels, img_tags=list(self._tags.values())
+        )
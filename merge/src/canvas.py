@@ -0,0 +1,69 @@
+import os
+import uuid
+
+import cv2
+import numpy as np
+import supervisely as sly
+
+
+class Canvas:
+    """Merged image assembled in memory or, for huge images, in a memory-mapped file on disk.
+
+    File-backed canvas keeps pixels in BGR order, so it is encoded by cv2 straight from the file
+    and uploaded by path without a copy of the whole image in memory.
+    """
+
+    def __init__(self, height: int, width: int, channels: int, path: str = None):
+        self.path = path
+        if path is None:
+            self._data = np.zeros((height, width, channels), dtype=np.uint8)
+        else:
+            sly.fs.ensure_base_path(path)
+            self._data = np.memmap(path, dtype=np.uint8, mode="w+", shape=(height, width, channels))
+
+    @property
+    def shape(self):
+        return self._data.shape
+
+    @property
+    def is_mapped(self) -> bool:
+        return self.path is not None
+
+    def paste(self, top: int, left: int, part: np.ndarray):
+        """Writes RGB part at (top, left), pixels outside of the canvas are clipped."""
+        bottom = min(top + part.shape[0], self._data.shape[0])
+        right = min(left + part.shape[1], self._data.shape[1])
+        if bottom <= top or right <= left:
+            return
+        part = part[: bottom - top, : right - left]
+        if self.is_mapped:
+            code = cv2.COLOR_RGBA2BGRA if part.shape[2] == 4 else cv2.COLOR_RGB2BGR
+            part = cv2.cvtColor(part, code)
+        self._data[top:bottom, left:right] = part
+
+    def upload(self, api: sly.Api, dataset_id: int, name: str) -> sly.ImageInfo:
+        if not self.is_mapped:
+            return api.image.upload_np(dataset_id, name, self._data)
+        self._data.flush()
+        image_path = f"{self.path}{sly.fs.get_file_ext(name)}"
+        try:
+            if not cv2.imwrite(image_path, self._data):
+                raise RuntimeError(f"Can not encode merged image {name}")
+            return api.image.upload_path(dataset_id, name, image_path)
+        finally:
+            sly.fs.silent_remove(image_path)
+
+    def close(self):
+        if self.is_mapped:
+            del self._data
+            sly.fs.silent_remove(self.path)
+
+
+def create_canvas(
+    height: int, width: int, channels: int, name: str, dir_path: str, min_pixels: int
+) -> Canvas:
+    """Images of at least `min_pixels` pixels are assembled on disk if cv2 can encode them."""
+    ext = sly.fs.get_file_ext(name)
+    if height * width >= min_pixels and cv2.haveImageWriter(f"canvas{ext}"):
+        return Canvas(height, width, channels, os.path.join(dir_path, uuid.uuid4().hex))
+    return Canvas(height, width, channels)
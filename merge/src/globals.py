@@ -30,3 +30,10 @@ if SRC_PROJECT is None:
 PROJECT_META = sly.ProjectMeta.from_json(app.public_api.project.get_meta(PROJECT_ID))
 # if len(meta.obj_classes) == 0:
 #     raise ValueError("Project should have at least one class")
+
+# parts of one original image are downloaded and pasted by chunks
+DOWNLOAD_CHUNK_SIZE = 50
+DOWNLOAD_CHUNK_PIXELS = 100_000_000
+
+# merged images of at least this size are assembled in a memory-mapped file on disk
+MEMMAP_MIN_PIXELS = 100_000_000
@@ -1,12 +1,17 @@
 import asyncio
-from collections import defaultdict
+from collections import defaultdict, namedtuple
+import os
+import time
 
+from annotation_builder import AnnotationBuilder
+from canvas import create_canvas
 import globals as g
+from neighbors import get_label_bboxes, NeighborIndex
 import numpy as np
 import supervisely as sly
+from sliding_window.progress import format_speed, ProgressReporter, ProgressSnapshot
 from supervisely.geometry.sliding_windows_fuzzy import SlidingWindowBorderStrategy
 from typing import List
-from tqdm import tqdm
 
 
 class Regexps:
@@ -39,6 +44,71 @@ class Regexps:
         return None
 
 
+NAME_FORMAT_ERROR = (
+    "Incorrect images names. Should be: "
+    "<image name>___<window index>_<window top coordinate>_<window left coordinate>.<image extension> "
+    "or <image name>___<window index>_<window top coordinate>_<window left coordinate>_<orig image dimensions>.<image extension> "
+    "Use Sliding window split app first to correctly split images."
+)
+
+
+# the only fields of parts kept for the whole dataset
+Part = namedtuple("Part", ["id", "height", "width", "top", "left"])
+
+
+def group_parts(images: List[sly.ImageInfo]):
+    """Groups parts by original image name using only their names.
+
+    Returns {original name: [Part]} and original dimensions stored in names as
+    {original name: {"height": h, "width": w}}.
+    """
+    parts = defaultdict(list)
+    original_dims = defaultdict(dict)
+    for image_info in images:
+        if image_info.name.count("___") != 1:
+            raise RuntimeError(NAME_FORMAT_ERROR)
+
+        real_name = image_info.name.split("___")[0]
+        ext = Regexps.get_ext(image_info.name)
+        settings = Regexps.extract_by_regexp(image_info.name, Regexps.settings_re)
+        original_dims_info = Regexps.get_orig_dimensions(image_info.name, Regexps.dim_re)
+        if settings is None:
+            raise RuntimeError(NAME_FORMAT_ERROR)
+
+        window_top = int(settings.split("_")[1])
+        window_left = int(settings.split("_")[2])
+
+        original_name = "{}{}".format(real_name, ext)
+        parts[original_name].append(
+            Part(image_info.id, image_info.height, image_info.width, window_top, window_left)
+        )
+        if original_dims_info is not None:
+            original_dims[original_name]["height"] = original_dims_info[0]
+            original_dims[original_name]["width"] = original_dims_info[1]
+    return parts, original_dims
+
+
+def iter_chunks(windows_info: List[dict], max_count: int, max_pixels: int):
+    """Splits parts into download chunks limited by count and by total pixels."""
+    chunk, chunk_pixels = [], 0
+    for window in windows_info:
+        pixels = window["height"] * window["width"]
+        if len(chunk) > 0 and (len(chunk) >= max_count or chunk_pixels + pixels > max_pixels):
+            yield chunk
+            chunk, chunk_pixels = [], 0
+        chunk.append(window)
+        chunk_pixels += pixels
+    if len(chunk) > 0:
+        yield chunk
+
+
+def log_progress(snapshot: ProgressSnapshot):
+    sly.logger.info(
+        f"{snapshot.message}: {snapshot.current} images, {snapshot.tiles} parts "
+        f"({format_speed(snapshot, 'images', 'parts')})"
+    )
+
+
 @g.app.callback("merge")
 @sly.timeit
 def merge(api: sly.Api, task_id, context, state, app_logger):
@@ -56,106 +126,75 @@ def merge(api: sly.Api, task_id, context, state, app_logger):
 
     # Extract strategy
     border_strategy = sliding_window_settings.get("borderStrategy", "none")
+    # images without any crop after split tile filtering, per dataset of the split project
+    tile_filter = src_project_info.custom_data.get("tileFilter", {})
+    images_without_tiles = tile_filter.get("imagesWithoutTiles", {})
 
     sly.logger.info(f"Sliding window settings: {sliding_window_settings}")
 
-    images_progress = tqdm(desc="Merged images")
-
-    parts_progress = tqdm(total=src_project_info.images_count, desc="Merging parts")
+    # merged images and parts are reported together by a background thread
+    progress = ProgressReporter(
+        log_progress,
+        message="Merged images",
+        total_tiles=src_project_info.images_count,
+        interval=5,
+    ).start()
 
     for src_dataset in api.dataset.get_list(g.SRC_PROJECT.id):
         dst_dataset = api.dataset.create(dst_project.id, src_dataset.name)
-        images = api.image.get_list(src_dataset.id)
-        image_ids = [image_info.id for image_info in images]
-        # image_names = [image_info.name for image_info in images]
-
-        ann_infos = api.annotation.download_batch(src_dataset.id, image_ids)
-        anns = [
-            sly.Annotation.from_json(ann_info.annotation, g.PROJECT_META) for ann_info in ann_infos
-        ]
-
-        parts_ids = defaultdict(list)
-        parts_top_left = defaultdict(list)
-        parts_anns = defaultdict(list)
-        original_dims = defaultdict(dict)
-
-        max_height = defaultdict(int)
-        max_width = defaultdict(int)
-        for image_info, ann in zip(images, anns):
-            # sly.logger.info(f'{image_info.name=}')
-            if image_info.name.count("___") != 1:
-                raise RuntimeError(
-                    "Incorrect images names. Should be: "
-                    "<image name>___<window index>_<window top coordinate>_<window left coordinate>.<image extension> "
-                    "or <image name>___<window index>_<window top coordinate>_<window left coordinate>_<orig image dimensions>.<image extension> "
-                    "Use Sliding window split app first to correctly split images."
+        # only ids, sizes and positions of parts are kept for the whole dataset
+        parts, original_dims = group_parts(api.image.get_list(src_dataset.id))
+
+        # all windows of these images were skipped, they are restored as black images
+        for original_name, size in images_without_tiles.get(str(src_dataset.id), {}).items():
+            if original_name not in parts:
+                empty_image = np.zeros((size["height"], size["width"], 3), dtype=np.uint8)
+                merged_image_info = api.image.upload_np(dst_dataset.id, original_name, empty_image)
+                api.annotation.upload_ann(
+                    merged_image_info.id, sly.Annotation(empty_image.shape[:2])
                 )
-
-            real_name = image_info.name.split("___")[0]
-            # real_name = Regexps.extract_by_regexp(image_info.name, Regexps.filename_re)
-            ext = Regexps.get_ext(image_info.name)
-            settings = Regexps.extract_by_regexp(image_info.name, Regexps.settings_re)
-            original_dims_info = Regexps.get_orig_dimensions(image_info.name, Regexps.dim_re)
-
-            if settings is None:
-                raise RuntimeError(
-                    "Incorrect images names. Should be: "
-                    "<image name>___<window index>_<window top coordinate>_<window left coordinate>.<image extension> "
-                    "or <image name>___<window index>_<window top coordinate>_<window left coordinate>_<orig image dimensions>.<image extension> "
-                    "Use Sliding window split app first to correctly split images."
-                )
-
-            # window_index = int(settings.split("_")[0])
-            window_top = int(settings.split("_")[1])
-            window_left = int(settings.split("_")[2])
-
-            original_name = "{}{}".format(real_name, ext)
-
-            max_height[original_name] = max(max_height[original_name], window_top + ann.img_size[0])
-            max_width[original_name] = max(max_width[original_name], window_left + ann.img_size[1])
-            parts_ids[original_name].append(image_info.id)
-            parts_top_left[original_name].append((window_top, window_left))
-            parts_anns[original_name].append(ann)
-            if original_dims_info is not None:
-                original_dims[original_name]["height"] = original_dims_info[0]
-                original_dims[original_name]["width"] = original_dims_info[1]
-
-        for original_name in parts_ids.keys():
-            images = api.image.download_nps(src_dataset.id, parts_ids[original_name])
-            height = max_height[original_name]
-            width = max_width[original_name]
-            channels = images[0].shape[2]
-            final_image = np.zeros((height, width, channels), dtype=np.uint8)
-            final_ann = sly.Annotation(final_image.shape[:2])
-
-            # Group windows by position for easier overlap detection
+                progress.update(1)
+
+        for original_name, image_parts in parts.items():
+            started = time.perf_counter()
+            # dimensions from names keep the full size if border windows were skipped,
+            # regions without crops are black
+            dims = original_dims.get(original_name, {})
+            height = max(
+                max(part.top + part.height for part in image_parts),
+                dims.get("height", 0),
+            )
+            width = max(
+                max(part.left + part.width for part in image_parts),
+                dims.get("width", 0),
+            )
+
+            # annotations of one original image at a time, pixels are downloaded later by chunks
+            ann_infos = api.annotation.download_batch(
+                src_dataset.id, [part.id for part in image_parts]
+            )
             windows_info = []
-            for image_part, ann, (top, left) in zip(
-                images, parts_anns[original_name], parts_top_left[original_name]
-            ):
+            for part, ann_info in zip(image_parts, ann_infos):
                 windows_info.append(
                     {
-                        "image": image_part,
-                        "ann": ann,
-                        "top": top,
-                        "left": left,
-                        "bottom": top + image_part.shape[0],
-                        "right": left + image_part.shape[1],
-                        "height": image_part.shape[0],
-                        "width": image_part.shape[1],
+                        "id": part.id,
+                        "ann": sly.Annotation.from_json(ann_info.annotation, g.PROJECT_META),
+                        "top": part.top,
+                        "left": part.left,
+                        "bottom": part.top + part.height,
+                        "right": part.left + part.width,
+                        "height": part.height,
+                        "width": part.width,
                     }
                 )
+            del ann_infos
+            # labels and tags are collected as is, the annotation is created once
+            ann_builder = AnnotationBuilder((height, width))
 
             # Sort windows by position (top-to-bottom, left-to-right)
             windows_info.sort(key=lambda x: (x["top"], x["left"]))
 
-            # Calculate grid width (number of windows per row)
-            # Count how many windows have the same top coordinate as the first window
-            if len(windows_info) > 0:
-                first_top = windows_info[0]["top"]
-                grid_width = sum(1 for w in windows_info if w["top"] == first_top)
-            else:
-                grid_width = 0
+            neighbors = NeighborIndex(windows_info)
 
             # Process each window
             for idx, window in enumerate(windows_info):
@@ -163,12 +202,13 @@ def merge(api: sly.Api, task_id, context, state, app_logger):
                 window_h, window_w = window["height"], window["width"]
 
                 # ----------- Helper to check if label should be cropped on a side ----------- #
-                def should_crop_on_side(label, side, neighbor_window, crop_boundary_local):
+                def should_crop_on_side(bbox, cls, side, neighbor_window, crop_boundary_local):
                     """
                     Check if label should be cropped on the given side.
                     Returns True if cropping is allowed (neighbor has matching label on the same edge),
                     False if cropping should be skipped (no matching label in neighbor on that edge).
 
+                    bbox: bbox of the label in local window coordinates
                     crop_boundary_local: the crop boundary position in local window coordinates
                     """
                     if neighbor_window is None:
@@ -177,10 +217,6 @@ def merge(api: sly.Api, task_id, context, state, app_logger):
                     if crop_boundary_local is None or crop_boundary_local == 0:
                         return False  # No cropping on this side
 
-                    # Label is in LOCAL coordinates of current window
-                    bbox = label.geometry.to_bbox()
-                    cls = label.obj_class.name
-
                     # Check if label touches/crosses the crop boundary (in LOCAL coordinates)
                     touches_crop_boundary = False
                     if side == "left":
@@ -197,40 +233,24 @@ def merge(api: sly.Api, task_id, context, state, app_logger):
                             False  # Label doesn't touch the crop boundary on this side, don't crop
                         )
 
-                    # Translate current label to global coordinates for comparison with neighbor
-                    label_global = label.translate(top, left)
-                    bbox_global = label_global.geometry.to_bbox()
-
-                    # Check if neighbor windows have matching label that overlaps on the perpendicular axis
-                    for n_label in neighbor_window["ann"].labels:
-                        if n_label.obj_class.name == cls:
-                            # Translate neighbor label to global coordinates
-                            n_label_global = n_label.translate(
-                                neighbor_window["top"], neighbor_window["left"]
-                            )
-                            n_bbox = n_label_global.geometry.to_bbox()
-
-                            # Check if labels overlap on perpendicular axis (in global coordinates)
-                            overlaps = False
-                            if side in ["left", "right"]:
-                                # For horizontal neighbors, check vertical overlap
-                                overlaps = (
-                                    n_bbox.top < bbox_global.bottom
-                                    and n_bbox.bottom > bbox_global.top
-                                )
-                            elif side in ["top", "bottom"]:
-                                # For vertical neighbors, check horizontal overlap
-                                overlaps = (
-                                    n_bbox.left < bbox_global.right
-                                    and n_bbox.right > bbox_global.left
-                                )
-
-                            if overlaps:
-                                # Found matching label in neighbor that aligns with this label
-                                return True  # CROP - the object continues in the neighbor
-
-                    # No matching label found in neighbor on the same edge - object ends here
-                    return False  # Don't crop - keep the whole label
+                    # Neighbor labels of the same class, bboxes in global coordinates
+                    n_bboxes = get_label_bboxes(neighbor_window).get(cls)
+                    if n_bboxes is None:
+                        return False
+
+                    # CROP if any of them overlaps on the perpendicular axis (in global coordinates):
+                    # the object continues in the neighbor
+                    if side in ["left", "right"]:
+                        # For horizontal neighbors, check vertical overlap
+                        overlaps = (n_bboxes[:, 0] < bbox.bottom + top) & (
+                            n_bboxes[:, 2] > bbox.top + top
+                        )
+                    else:
+                        # For vertical neighbors, check horizontal overlap
+                        overlaps = (n_bboxes[:, 1] < bbox.right + left) & (
+                            n_bboxes[:, 3] > bbox.left + left
+                        )
+                    return bool(overlaps.any())
 
                 # -------------- Calculate default crop borders based on overlap ------------- #
                 # These will be used for labels that SHOULD be cropped
@@ -239,51 +259,42 @@ def merge(api: sly.Api, task_id, context, state, app_logger):
                 default_crop_right = window_w
                 default_crop_bottom = window_h
 
-                # Left neighbor (idx - 1, but only if same row)
-                left_idx = idx - 1
+                # Neighbors with exact overlaps, found by coordinates of windows
                 left_neighbor = None
-                if left_idx >= 0 and windows_info[left_idx]["top"] == top:
-                    other = windows_info[left_idx]
-                    other_right = other["left"] + other["width"]
-                    if other_right > left:
-                        actual_overlap = other_right - left
-                        default_crop_left = actual_overlap - actual_overlap // 2
-                        left_neighbor = other
-
-                # Right neighbor (idx + 1, but only if same row)
-                right_idx = idx + 1
+                match = neighbors.get(idx, "left")
+                if match is not None:
+                    other_idx, actual_overlap = match
+                    default_crop_left = actual_overlap - actual_overlap // 2
+                    left_neighbor = windows_info[other_idx]
+
                 right_neighbor = None
-                if right_idx < len(windows_info) and windows_info[right_idx]["top"] == top:
-                    other = windows_info[right_idx]
-                    this_right = left + window_w
-                    if this_right > other["left"]:
-                        actual_overlap = this_right - other["left"]
-                        default_crop_right = window_w - actual_overlap // 2 - 1
-                        right_neighbor = other
-
-                # Top neighbor (idx - grid_width)
-                top_idx = idx - grid_width
+                match = neighbors.get(idx, "right")
+                if match is not None:
+                    other_idx, actual_overlap = match
+                    default_crop_right = window_w - actual_overlap // 2 - 1
+                    right_neighbor = windows_info[other_idx]
+
                 top_neighbor = None
-                if top_idx >= 0:
-                    other = windows_info[top_idx]
-                    if other["left"] == left:
-                        other_bottom = other["top"] + other["height"]
-                        if other_bottom > top:
-                            actual_overlap = other_bottom - top
-                            default_crop_top = actual_overlap - actual_overlap // 2
-                            top_neighbor = other
-
-                # Bottom neighbor (idx + grid_width)
-                bottom_idx = idx + grid_width
+                match = neighbors.get(idx, "top")
+                if match is not None:
+                    other_idx, actual_overlap = match
+                    default_crop_top = actual_overlap - actual_overlap // 2
+                    top_neighbor = windows_info[other_idx]
+
                 bottom_neighbor = None
-                if bottom_idx < len(windows_info):
-                    other = windows_info[bottom_idx]
-                    if other["left"] == left:
-                        this_bottom = top + window_h
-                        if this_bottom > other["top"]:
-                            actual_overlap = this_bottom - other["top"]
-                            default_crop_bottom = window_h - actual_overlap // 2 - 1
-                            bottom_neighbor = other
+                match = neighbors.get(idx, "bottom")
+                if match is not None:
+                    other_idx, actual_overlap = match
+                    default_crop_bottom = window_h - actual_overlap // 2 - 1
+                    bottom_neighbor = windows_info[other_idx]
+
+                # part of the window written to the canvas, overlaps are split in halves
+                window["region"] = (
+                    default_crop_top,
+                    default_crop_left,
+                    window_h if bottom_neighbor is None else default_crop_bottom + 1,
+                    window_w if right_neighbor is None else default_crop_right + 1,
+                )
 
                 # Translate and crop labels
                 ann: sly.Annotation = window["ann"]
@@ -300,14 +311,18 @@ def merge(api: sly.Api, task_id, context, state, app_logger):
                     label_crop_bottom = default_crop_bottom
 
                     # Check each side: if label shouldn't be cropped, extend boundary
-                    if not should_crop_on_side(label, "left", left_neighbor, default_crop_left):
+                    bbox = label.geometry.to_bbox()
+                    cls = label.obj_class.name
+                    if not should_crop_on_side(bbox, cls, "left", left_neighbor, default_crop_left):
                         label_crop_left = 0
-                    if not should_crop_on_side(label, "right", right_neighbor, default_crop_right):
+                    if not should_crop_on_side(
+                        bbox, cls, "right", right_neighbor, default_crop_right
+                    ):
                         label_crop_right = window_w
-                    if not should_crop_on_side(label, "top", top_neighbor, default_crop_top):
+                    if not should_crop_on_side(bbox, cls, "top", top_neighbor, default_crop_top):
                         label_crop_top = 0
                     if not should_crop_on_side(
-                        label, "bottom", bottom_neighbor, default_crop_bottom
+                        bbox, cls, "bottom", bottom_neighbor, default_crop_bottom
                     ):
                         label_crop_bottom = window_h
 
@@ -391,19 +406,14 @@ def merge(api: sly.Api, task_id, context, state, app_logger):
                         return [translated]
 
                 cropped_ann = ann.transform_labels(
-                    _translate_and_crop_label, new_size=final_image.shape[:2]
+                    _translate_and_crop_label, new_size=(height, width)
                 )
 
                 # Add labels and tags
-                final_ann = final_ann.add_labels(cropped_ann.labels)
-                final_ann = final_ann.clone(
-                    img_tags=final_ann.img_tags.merge_without_duplicates(cropped_ann.img_tags)
-                )
+                ann_builder.add(cropped_ann)
 
-                # Add image part
-                final_image[top : top + window_h, left : left + window_w, :] = window["image"]
-                parts_progress.update(1)
             # Adjust final image and annotation size if original dimensions are smaller (due to padding)
+            out_height, out_width = height, width
             if (
                 border_strategy == str(SlidingWindowBorderStrategy.ADD_PADDING)
                 and original_name in original_dims
@@ -411,13 +421,50 @@ def merge(api: sly.Api, task_id, context, state, app_logger):
                 orig_height = original_dims[original_name].get("height", height)
                 orig_width = original_dims[original_name].get("width", width)
                 if orig_height < height or orig_width < width:
-                    final_image = final_image[0:orig_height, 0:orig_width, :]
-                    final_ann = final_ann.clone(img_size=(orig_height, orig_width))
+                    out_height, out_width = min(orig_height, height), min(orig_width, width)
+                    ann_builder.img_size = (orig_height, orig_width)
+            final_ann = ann_builder.build()
+            ann_time = time.perf_counter() - started
+
+            # parts are pasted as soon as they are downloaded and released right away
+            canvas = None
+            try:
+                for chunk in iter_chunks(
+                    windows_info, g.DOWNLOAD_CHUNK_SIZE, g.DOWNLOAD_CHUNK_PIXELS
+                ):
+                    chunk_images = api.image.download_nps(src_dataset.id, [w["id"] for w in chunk])
+                    for window, image_part in zip(chunk, chunk_images):
+                        if canvas is None:
+                            canvas = create_canvas(
+                                out_height,
+                                out_width,
+                                image_part.shape[2],
+                                original_name,
+                                os.path.join(g.app.data_dir, "canvas"),
+                                g.MEMMAP_MIN_PIXELS,
+                            )
+                        # overlaps are written once: only the center region of every part
+                        region_top, region_left, region_bottom, region_right = window["region"]
+                        canvas.paste(
+                            window["top"] + region_top,
+                            window["left"] + region_left,
+                            image_part[region_top:region_bottom, region_left:region_right],
+                        )
+                        progress.update(0, tiles=1)
+                    del chunk_images
 
-            merged_image_info = api.image.upload_np(dst_dataset.id, original_name, final_image)
+                merged_image_info = canvas.upload(api, dst_dataset.id, original_name)
+            finally:
+                if canvas is not None:
+                    canvas.close()
             api.annotation.upload_ann(merged_image_info.id, final_ann)
-            images_progress.update(1)
+            progress.update(1)
+            sly.logger.info(
+                f"Merged {original_name}: {len(windows_info)} parts, {len(ann_builder)} labels, "
+                f"annotation {ann_time:.2f} sec, total {time.perf_counter() - started:.2f} sec"
+            )
 
+    progress.close()
     api.task.set_output_project(task_id, dst_project.id, dst_project.name)
     g.app.stop()
 
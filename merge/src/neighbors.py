@@ -0,0 +1,58 @@
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+SIDES = ["left", "right", "top", "bottom"]
+
+
+class NeighborIndex:
+    """Overlapping neighbors of windows found by coordinates, not by position in a regular grid.
+
+    Windows are grouped into rows by top and into columns by left coordinate. The neighbor on a
+    side is the next window of the same row or column if they overlap, so shifted border windows
+    and windows skipped during split do not break the lookup. All neighbors are found once,
+    `get` is a dict lookup.
+    """
+
+    def __init__(self, windows: List[dict]):
+        self._neighbors: Dict[str, Dict[int, Tuple[int, int]]] = {side: {} for side in SIDES}
+        rows = defaultdict(list)
+        columns = defaultdict(list)
+        for i, window in enumerate(windows):
+            rows[window["top"]].append(i)
+            columns[window["left"]].append(i)
+        for row in rows.values():
+            self._link(windows, row, "left", "width", "left", "right")
+        for column in columns.values():
+            self._link(windows, column, "top", "height", "top", "bottom")
+
+    def _link(self, windows, indices, start_key, size_key, before_side, after_side):
+        indices = sorted(indices, key=lambda i: windows[i][start_key])
+        for before, after in zip(indices, indices[1:]):
+            overlap = (
+                windows[before][start_key] + windows[before][size_key] - windows[after][start_key]
+            )
+            if overlap > 0:
+                self._neighbors[after_side][before] = (after, overlap)
+                self._neighbors[before_side][after] = (before, overlap)
+
+    def get(self, window_index: int, side: str) -> Optional[Tuple[int, int]]:
+        """(neighbor index, overlap in pixels) of the window on the side or None."""
+        return self._neighbors[side].get(window_index)
+
+
+def get_label_bboxes(window: dict) -> Dict[str, np.ndarray]:
+    """Bboxes of window labels in global coordinates grouped by class name: arrays of
+    (top, left, bottom, right) rows, computed on first use and kept in the window.
+    """
+    if "bboxes" not in window:
+        grouped = defaultdict(list)
+        for label in window["ann"].labels:
+            bbox = label.geometry.to_bbox()
+            grouped[label.obj_class.name].append([bbox.top, bbox.left, bbox.bottom, bbox.right])
+        offset = np.array([window["top"], window["left"], window["top"], window["left"]])
+        window["bboxes"] = {
+            cls: np.array(bboxes, dtype=np.int64) + offset for cls, bboxes in grouped.items()
+        }
+    return window["bboxes"]
@@ -0,0 +1,113 @@
+import threading
+import time
+from collections import namedtuple
+from typing import Callable, Optional
+
+import supervisely as sly
+
+ProgressSnapshot = namedtuple(
+    "ProgressSnapshot",
+    ["message", "current", "total", "tiles", "items_per_sec", "tiles_per_sec", "eta"],
+)
+
+
+class ProgressReporter:
+    """Collects progress updates from hot loops and reports them from a background thread.
+
+    `update` only changes counters under a lock. `report_fn` gets a snapshot at most once per
+    `interval` seconds and only if something changed, so blocking API calls never stall the work.
+    ETA is estimated by items if `total` is known, otherwise by tiles if `total_tiles` is known.
+    """
+
+    def __init__(
+        self,
+        report_fn: Callable[[ProgressSnapshot], None],
+        total: Optional[int] = None,
+        message: str = "",
+        total_tiles: Optional[int] = None,
+        interval: float = 1.0,
+    ):
+        self._report_fn = report_fn
+        self._interval = interval
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self.reset(message, total, total_tiles)
+
+    def reset(self, message: str, total: Optional[int] = None, total_tiles: Optional[int] = None):
+        """Starts a new stage: counters and speed are reset."""
+        with self._lock:
+            self._message = message
+            self._total = total
+            self._total_tiles = total_tiles
+            self._current = 0
+            self._tiles = 0
+            self._started_at = time.monotonic()
+            self._changed = True
+
+    def update(self, n: int = 1, tiles: int = 0):
+        with self._lock:
+            self._current += n
+            self._tiles += tiles
+            self._changed = True
+
+    def snapshot(self) -> ProgressSnapshot:
+        with self._lock:
+            elapsed = max(time.monotonic() - self._started_at, 1e-6)
+            items_per_sec = self._current / elapsed
+            tiles_per_sec = self._tiles / elapsed
+            eta = None
+            if self._total is not None and items_per_sec > 0:
+                eta = max(self._total - self._current, 0) / items_per_sec
+            elif self._total_tiles is not None and tiles_per_sec > 0:
+                eta = max(self._total_tiles - self._tiles, 0) / tiles_per_sec
+            return ProgressSnapshot(
+                self._message,
+                self._current,
+                self._total,
+                self._tiles,
+                items_per_sec,
+                tiles_per_sec,
+                eta,
+            )
+
+    def flush(self):
+        with self._lock:
+            if not self._changed:
+                return
+            self._changed = False
+        try:
+            self._report_fn(self.snapshot())
+        except Exception as e:
+            sly.logger.warn(f"Can not report progress: {repr(e)}")
+
+    def _run(self):
+        while not self._stopped.wait(self._interval):
+            self.flush()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="progress", daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def format_speed(snapshot: ProgressSnapshot, items_name: str, tiles_name: str = None) -> str:
+    """Returns text like '3.2 images/s, 41.0 tiles/s, ETA 0:05:12'."""
+    parts = [f"{snapshot.items_per_sec:.1f} {items_name}/s"]
+    if tiles_name is not None:
+        parts.append(f"{snapshot.tiles_per_sec:.1f} {tiles_name}/s")
+    if snapshot.eta is not None:
+        parts.append("ETA {}".format(time.strftime("%H:%M:%S", time.gmtime(snapshot.eta))))
+    return ", ".join(parts)
@@ -0,0 +1,77 @@
+from typing import Union
+
+import cv2
+from labels_index import LabelsIndex
+import numpy as np
+import supervisely as sly
+from streaming import RawImage
+from windows import to_rectangle
+
+
+def get_thumbnail(img: Union[np.ndarray, RawImage], max_size: int):
+    """Returns downscaled RGB copy of the image and its scale, huge images are read by bands."""
+    scale = min(1.0, max_size / max(img.shape[0], img.shape[1]))
+    if isinstance(img, RawImage):
+        return img.read_scaled(scale), scale
+    if scale == 1:
+        return img, scale
+    size = (max(1, round(img.shape[1] * scale)), max(1, round(img.shape[0] * scale)))
+    return cv2.resize(img, size, interpolation=cv2.INTER_AREA), scale
+
+
+def get_occupancy(thumbnail: np.ndarray, min_std: float, kernel_size: int = 5) -> np.ndarray:
+    """Mask of thumbnail pixels with real content: local standard deviation is above `min_std`.
+
+    Flat regions (black padding, nodata borders, empty slide background) are not occupied.
+    """
+    gray = cv2.cvtColor(thumbnail, cv2.COLOR_RGB2GRAY).astype(np.float32)
+    kernel = (kernel_size, kernel_size)
+    mean = cv2.boxFilter(gray, -1, kernel)
+    mean_sq = cv2.boxFilter(gray * gray, -1, kernel)
+    return np.sqrt(np.maximum(mean_sq - mean * mean, 0)) > min_std
+
+
+def get_content_mask(
+    img: Union[np.ndarray, RawImage],
+    ann: sly.Annotation,
+    windows: np.ndarray,
+    state: dict,
+    mask_size: int,
+) -> np.ndarray:
+    """Which windows of the regular grid are emitted.
+
+    With "content" placement a window is kept if occupied pixels of the low resolution mask
+    cover at least `contentMinPercent` of it (integral image of the mask, O(1) per window),
+    or if it has labels and `keepLabeledWindows` is set. Grid indices are not changed, so crop
+    names stay compatible with merge.
+    """
+    if state["windowPlacement"] != "content":
+        return np.ones(len(windows), dtype=bool)
+
+    thumbnail, scale = get_thumbnail(img, mask_size)
+    occupancy = get_occupancy(thumbnail, state["contentMinStd"])
+    integral = cv2.integral(occupancy.astype(np.uint8))
+
+    mask_height, mask_width = occupancy.shape
+    tops = np.clip(np.floor(windows[:, 0] * scale).astype(np.int64), 0, mask_height - 1)
+    lefts = np.clip(np.floor(windows[:, 1] * scale).astype(np.int64), 0, mask_width - 1)
+    bottoms = np.clip(np.ceil((windows[:, 2] + 1) * scale).astype(np.int64), tops + 1, mask_height)
+    rights = np.clip(np.ceil((windows[:, 3] + 1) * scale).astype(np.int64), lefts + 1, mask_width)
+    occupied = (
+        integral[bottoms, rights]
+        - integral[tops, rights]
+        - integral[bottoms, lefts]
+        + integral[tops, lefts]
+    )
+    # padding beyond the image counts as empty area of the window
+    window_area = ((windows[:, 2] - windows[:, 0] + 1) * (windows[:, 3] - windows[:, 1] + 1)) * (
+        scale * scale
+    )
+    mask = occupied * 100 >= state["contentMinPercent"] * np.maximum(window_area, 1)
+
+    if state["keepLabeledWindows"] is True and len(ann.labels) > 0:
+        labels_index = LabelsIndex(ann, cell_size=max(windows[0, 2:] - windows[0, :2] + 1))
+        for window_index in np.flatnonzero(~mask).tolist():
+            if len(labels_index.query(to_rectangle(windows[window_index]))) > 0:
+                mask[window_index] = True
+    return mask
@@ -1,7 +1,10 @@
+from concurrent.futures import ThreadPoolExecutor
+import itertools
 import os
 import sys
 from pathlib import Path
 
+from preview_cache import LRUCache
 import supervisely as sly
 from supervisely.app.v1.app_service import AppService
 
@@ -21,14 +24,42 @@ TEAM_ID = sly.env.team_id()
 WORKSPACE_ID = sly.env.workspace_id()
 PROJECT_ID = sly.env.project_id()
 
-PROJECT_INFO = app.public_api.project.get_info_by_id(PROJECT_ID)
-if PROJECT_INFO is None:
-    raise RuntimeError(f"Project id={PROJECT_ID} not found")
-
-PROJECT_META = sly.ProjectMeta.from_json(app.public_api.project.get_meta(PROJECT_ID))
+# project info and meta are fetched concurrently, images are listed in background by main
+with ThreadPoolExecutor(max_workers=2) as executor:
+    _project_info = executor.submit(app.public_api.project.get_info_by_id, PROJECT_ID)
+    _project_meta = executor.submit(app.public_api.project.get_meta, PROJECT_ID)
+    PROJECT_INFO = _project_info.result()
+    if PROJECT_INFO is None:
+        raise RuntimeError(f"Project id={PROJECT_ID} not found")
+    PROJECT_META = sly.ProjectMeta.from_json(_project_meta.result())
 # if len(meta.obj_classes) == 0:
 #     raise ValueError("Project should have at least one class")
 
-IMAGES_INFO = []
+IMAGES_INDEX = None  # project_index.ProjectIndex, filled in background
+INDEX_WORKERS = 8
+
+MAX_VIDEO_HEIGHT = 800  # in pixels
+# preview shows evenly spread windows if there are more of them
+MAX_PREVIEW_FRAMES = 500
+PREVIEW_QUEUE_SIZE = 8
+# decoded preview images with annotations (up to 1 GB) and uploaded previews (fields and remote
+# path), by image id and settings
+PREVIEW_SOURCES = LRUCache(maxsize=3, maxbytes=1024 * 2**20, sizeof=lambda source: source[0].nbytes)
+PREVIEW_RESULTS = LRUCache(maxsize=64)
+PREVIEW_COUNTER = itertools.count()
 
-MAX_VIDEO_HEIGHT = 800  # in pixels
\ No newline at end of file
+# split pipeline: source images are fetched per dataset in batches limited by count and decoded size
+FETCH_BATCH_SIZE = 50
+FETCH_BATCH_BYTES = 256 * 1024 * 1024
+DOWNLOAD_WORKERS = 2
+PREFETCH_BATCHES = 2
+CROP_WORKERS = 2
+ENCODE_WORKERS = os.cpu_count() or 1
+UPLOAD_QUEUE_SIZE = 4
+# max side of the low resolution mask used by content-aware window placement
+CONTENT_MASK_SIZE = 1024
+# images with at least this number of pixels are split by bands if streaming is enabled
+STREAMING_MIN_PIXELS = 100_000_000
+# tiles are uploaded in batches limited by count and size in bytes
+UPLOAD_BATCH_SIZE = 100
+UPLOAD_BATCH_BYTES = 64 * 1024 * 1024
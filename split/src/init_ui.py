@@ -11,11 +11,6 @@ def init_input_project(api: sly.Api, data: dict, project_info):
 
 
 def init_settings(state):
-    state["windowHeight"] = 256
-    state["windowWidth"] = 256
-    state["overlapY"] = 32
-    state["overlapX"] = 32
-
     state["usePercents"] = False
     state["useSquare"] = False
     state["windowHeightPx"] = 256
@@ -32,7 +27,38 @@ def init_settings(state):
     state["resizeValue"] = 0
 
     state["borderStrategy"] = "shift_window"  # "add_padding"
+
+    # "grid" - all windows, "content" - only grid windows over image content (not nodata)
+    state["windowPlacement"] = "grid"
+    state["contentMinStd"] = 3
+    state["contentMinPercent"] = 5
+    state["keepLabeledWindows"] = True
+
+    # tiles without labels: "keep", "drop", "random" or "stride" fraction of them
+    state["emptyTiles"] = "keep"
+    state["emptyTilesPercent"] = 10
+    # tiles without labels and with flat pixels (padding, nodata) are skipped
+    state["skipUniformTiles"] = False
+    state["uniformTilesMaxStd"] = 2
+
+    # scales of pyramid levels, "suffix" - "_x0.5" in image names, "dataset" - in dataset names
+    state["pyramidScales"] = [1]
+    state["pyramidOutput"] = "suffix"
+
+    state["tileCodec"] = "source"  # "jpeg", "png", "webp"
+    state["jpegQuality"] = 95
+    state["pngCompression"] = 3
+    state["webpQuality"] = 90
+
+    # 1 - crop in the app process, more - shard windows across worker processes
+    state["workersCount"] = 1
+    # huge images are downloaded to disk and processed by bands of windows
+    state["streamLargeImages"] = False
+
+    state["previewMode"] = "video"  # "overlay"
     state["fps"] = 4
+    # preview the same image again instead of a random one
+    state["pinPreviewImage"] = False
     state["drawLabels"] = True
     state["cleanLabels"] = False
     state["cleanLabelsThreshold"] = 50
@@ -0,0 +1,130 @@
+from collections import defaultdict
+from typing import List, Tuple
+
+import numpy as np
+import supervisely as sly
+
+
+class LabelsIndex:
+    """Uniform grid over label bounding boxes, built once per image.
+
+    Every window crops only the labels whose bboxes intersect it instead of walking all labels.
+    Labels that lie fully inside a window are only translated, without geometry crop.
+    """
+
+    def __init__(self, ann: sly.Annotation, cell_size: int):
+        self.ann = ann
+        self._cell_size = max(1, int(cell_size))
+
+        boxes = np.zeros((len(ann.labels), 4), dtype=np.int64)  # top, left, bottom, right
+        for idx, label in enumerate(ann.labels):
+            bbox = label.geometry.to_bbox()
+            boxes[idx] = (bbox.top, bbox.left, bbox.bottom, bbox.right)
+        self._boxes = boxes
+
+        self._areas = {}
+        self._bitmap_integrals = {}
+
+        self._grid = defaultdict(list)
+        for idx, (row0, col0, row1, col1) in enumerate(boxes // self._cell_size):
+            for row in range(row0, row1 + 1):
+                for col in range(col0, col1 + 1):
+                    self._grid[(row, col)].append(idx)
+
+    def query(self, rect: sly.Rectangle) -> np.ndarray:
+        """Returns sorted indices of labels whose bboxes intersect the rectangle."""
+        row0, col0 = rect.top // self._cell_size, rect.left // self._cell_size
+        row1, col1 = rect.bottom // self._cell_size, rect.right // self._cell_size
+        candidates = []
+        for row in range(row0, row1 + 1):
+            for col in range(col0, col1 + 1):
+                candidates.extend(self._grid.get((row, col), []))
+        if len(candidates) == 0:
+            return np.zeros(0, dtype=np.int64)
+
+        candidates = np.unique(np.array(candidates, dtype=np.int64))
+        boxes = self._boxes[candidates]
+        intersects = (
+            (boxes[:, 0] <= rect.bottom)
+            & (boxes[:, 2] >= rect.top)
+            & (boxes[:, 1] <= rect.right)
+            & (boxes[:, 3] >= rect.left)
+        )
+        return candidates[intersects]
+
+    def full_area(self, idx: int) -> float:
+        """Area of the source label in the full image, computed once per label."""
+        if idx not in self._areas:
+            geometry = self.ann.labels[idx].geometry
+            if isinstance(geometry, sly.Bitmap):
+                self._areas[idx] = float(np.count_nonzero(geometry.data))
+            else:
+                self._areas[idx] = geometry.area
+        return self._areas[idx]
+
+    def _bitmap_area_in_rect(self, idx: int, rect: sly.Rectangle) -> float:
+        """Counts bitmap pixels inside the rectangle with the integral image of the mask."""
+        geometry: sly.Bitmap = self.ann.labels[idx].geometry
+        if idx not in self._bitmap_integrals:
+            integral = np.zeros((geometry.data.shape[0] + 1, geometry.data.shape[1] + 1), np.int32)
+            np.cumsum(
+                np.cumsum(geometry.data, axis=0, dtype=np.int32), axis=1, out=integral[1:, 1:]
+            )
+            self._bitmap_integrals[idx] = integral
+        integral = self._bitmap_integrals[idx]
+
+        height, width = geometry.data.shape
+        top = min(max(rect.top - geometry.origin.row, 0), height)
+        left = min(max(rect.left - geometry.origin.col, 0), width)
+        bottom = min(max(rect.bottom - geometry.origin.row + 1, 0), height)
+        right = min(max(rect.right - geometry.origin.col + 1, 0), width)
+        return float(
+            integral[bottom, right]
+            - integral[top, right]
+            - integral[bottom, left]
+            + integral[top, left]
+        )
+
+    def crop(
+        self, rect: sly.Rectangle, min_area_percent: float = None
+    ) -> List[Tuple[int, sly.Label]]:
+        """Crops labels by the rectangle and moves them to its coordinates.
+
+        Returns pairs (index of the source label, cropped label), in the order of source labels.
+        If `min_area_percent` is set, fragments with less than this percent of the source label area
+        inside the rectangle are dropped.
+        """
+        results = []
+        for idx in self.query(rect):
+            idx = int(idx)
+            label = self.ann.labels[idx]
+            top, left, bottom, right = self._boxes[idx]
+            inside = (
+                top >= rect.top
+                and left >= rect.left
+                and bottom <= rect.bottom
+                and right <= rect.right
+            )
+            if min_area_percent is not None and self.full_area(idx) == 0:
+                continue
+            fragments = [label] if inside else label.crop(rect)
+            for fragment in fragments:
+                if min_area_percent is not None and not inside:
+                    if isinstance(label.geometry, sly.Bitmap):
+                        fragment_area = self._bitmap_area_in_rect(idx, rect)
+                    else:
+                        fragment_area = fragment.area
+                    if fragment_area / self.full_area(idx) * 100 <= min_area_percent:
+                        continue
+                results.append((idx, fragment.translate(-rect.top, -rect.left)))
+        return results
+
+    def relative_crop(self, rect: sly.Rectangle, min_area_percent: float = None) -> sly.Annotation:
+        """Same result as sly.Annotation.relative_crop, but only intersecting labels are processed.
+
+        See `crop` for `min_area_percent`.
+        """
+        if len(self.ann.pixelwise_scores_labels) > 0 and min_area_percent is None:
+            return self.ann.relative_crop(rect)
+        labels = [label for _, label in self.crop(rect, min_area_percent)]
+        return self.ann.clone(img_size=rect.to_size(), labels=labels)
@@ -1,100 +1,50 @@
 import asyncio
-from copy import copy, deepcopy
-import math
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from functools import partial
+import itertools
 import os
-import random
 
+from content import get_content_mask
 import cv2
 import globals as g
 import init_ui
+import numpy as np
+from pipeline import BackgroundStage, batch_by_dataset, imap_bounded
+import planner
+from preview_cache import get_preview_key
+from project_index import get_project_datasets, ProjectIndex, start_indexing
+from pyramid import get_level_name, get_level_size, get_scale_suffix, get_scales, iter_levels
+from rendering import PreviewRenderer, scale_windows, select_frames
+from sliding_window.progress import format_speed, ProgressReporter, ProgressSnapshot
 import supervisely as sly
-from supervisely.geometry.sliding_windows_fuzzy import (
-    SlidingWindowBorderStrategy,
-    SlidingWindowsFuzzy,
-)
-from tqdm import tqdm
-
-
-def pad_to_fixed_size(image, width: int, height: int):
-    image_height, image_width = image.shape[:2]
-    right_pad = max(width - image_width, 0)
-    bottom_pad = max(height - image_height, 0)
-    if right_pad == 0 and bottom_pad == 0:
-        return image
-    return cv2.copyMakeBorder(
-        image,
-        top=0,
-        bottom=bottom_pad,
-        left=0,
-        right=right_pad,
-        borderType=cv2.BORDER_CONSTANT,
-        value=(0, 0, 0),
-    )
-
-
-def resize_keep_aspect_by_height(image, height: int):
-    image_height, image_width = image.shape[:2]
-    if image_height == height:
-        return image
-    width = max(1, round(image_width * height / image_height))
-    return cv2.resize(image, (width, height), interpolation=cv2.INTER_LINEAR)
-
-
-def get_project_datasets(api: sly.Api, project_id):
-    try:
-        return api.dataset.get_list(project_id, recursive=True)
-    except TypeError:
-        return api.dataset.get_list(project_id)
+from streaming import download_raw, is_streamed, iter_bands, RawImage
+from tiles import get_tile_ext
+from uploader import UploadAccumulator
+from tile_filter import get_empty_keep_mask
+from windows import get_crop_names, get_merged_name, plan_windows
+from workers import SharedMemoryPool, process_windows
 
 
-def cache_images_info(api: sly.Api, project_id):
-    datasets = get_project_datasets(api, project_id)
-    for dataset_info in datasets:
-        g.IMAGES_INFO.extend(api.image.get_list(dataset_info.id))
+def refresh_index_progress(api: sly.Api, task_id, snapshot: ProgressSnapshot):
+    api.task.set_fields(
+        task_id, [{"field": "data.indexedImagesCount", "payload": snapshot.current}]
+    )
 
 
-def refresh_progress_preview(api: sly.Api, task_id, progress: tqdm):
+def refresh_progress_preview(api: sly.Api, task_id, snapshot: ProgressSnapshot):
     fields = [
-        {"field": "data.progressPreview", "payload": int(progress.n * 100 / progress.total)},
-        {"field": "data.progressPreviewMessage", "payload": progress.message},
-        {"field": "data.progressPreviewCurrent", "payload": progress.n},
-        {"field": "data.progressPreviewTotal", "payload": progress.total},
+        {
+            "field": "data.progressPreview",
+            "payload": int(snapshot.current * 100 / max(snapshot.total, 1)),
+        },
+        {"field": "data.progressPreviewMessage", "payload": snapshot.message},
+        {"field": "data.progressPreviewCurrent", "payload": snapshot.current},
+        {"field": "data.progressPreviewTotal", "payload": snapshot.total},
     ]
     api.task.set_fields(task_id, fields)
 
 
-def check_sliding_sizes_by_image(img_info, state):
-    if state["windowHeight"] > img_info.height:
-        state["windowHeight"] = img_info.height
-
-    if state["windowWidth"] > img_info.width:
-        state["windowWidth"] = img_info.width
-
-    return 0
-
-
-def get_sliding_windows_sizes(image_info, state):
-    if state["usePercents"] is True:
-        w_height = math.ceil(image_info.height * state["windowHeightPercent"] / 100)
-        overlap_y = math.ceil(w_height * state["overlapYPercent"] / 100)
-        if state["useSquare"] is True:
-            w_width = w_height
-            overlap_x = overlap_y
-        else:
-            w_width = math.ceil(image_info.width * state["windowWidthPercent"] / 100)
-            overlap_x = math.ceil(w_width * state["overlapXPercent"] / 100)
-    else:
-        w_height = state["windowHeightPx"]
-        w_width = state["windowWidthPx"] if state["useSquare"] is False else w_height
-        overlap_y = state["overlapYPx"]
-        overlap_x = state["overlapXPx"] if state["useSquare"] is False else overlap_y
-
-    state["windowHeight"] = w_height
-    state["windowWidth"] = w_width
-    state["overlapY"] = overlap_y
-    state["overlapX"] = overlap_x
-
-
 def _handle_error_and_exit(api: sly.Api, task_id: int, msg: str):
     sly.logger.warn(msg, exc_info=True)
     fields = [
@@ -106,10 +56,39 @@ def _handle_error_and_exit(api: sly.Api, task_id: int, msg: str):
     return
 
 
+@g.app.callback("index_images")
+@sly.timeit
+def index_images(api: sly.Api, task_id, context, state, app_logger):
+    # sent as the initial event: fields are set only after the session is initialized
+    progress = ProgressReporter(
+        partial(refresh_index_progress, api, task_id), message="Listing images"
+    ).start()
+
+    def _on_ready(images_count: int):
+        progress.close()
+        fields = [
+            {"field": "data.indexedImagesCount", "payload": images_count},
+            {"field": "data.indexReady", "payload": True},
+        ]
+        api.task.set_fields(task_id, fields)
+
+    start_indexing(
+        g.IMAGES_INDEX,
+        api,
+        g.PROJECT_INFO,
+        g.app.cache_dir,
+        g.INDEX_WORKERS,
+        progress=progress,
+        on_ready=_on_ready,
+    )
+
+
 @g.app.callback("preview")
 @sly.timeit
 def preview(api: sly.Api, task_id, context, state, app_logger):
-    if len(g.IMAGES_INFO) == 0:
+    # preview starts as soon as any image is listed
+    g.IMAGES_INDEX.wait_any()
+    if len(g.IMAGES_INDEX) == 0:
         message = f"Project {g.PROJECT_INFO.name} has no images"
         description = "Please, check your project and try again."
         api.task.set_output_error(task_id, message, description)
@@ -118,20 +97,20 @@ def preview(api: sly.Api, task_id, context, state, app_logger):
         return
     fields = [
         {"field": "data.videoUrl", "payload": None},
+        {"field": "data.previewImageUrl", "payload": None},
+        {"field": "data.previewManifest", "payload": None},
         {"field": "state.previewLoading", "payload": True},
     ]
     api.task.set_fields(task_id, fields)
 
-    image_info = random.choice(g.IMAGES_INFO)
-    get_sliding_windows_sizes(image_info=image_info, state=state)
-    check_sliding_sizes_by_image(img_info=image_info, state=state)
+    image_info = None
+    if state["pinPreviewImage"] is True and state["previewImageId"] is not None:
+        image_info = g.IMAGES_INDEX.table().find(state["previewImageId"])
+    if image_info is None:
+        image_info = g.IMAGES_INDEX.random_entry()
 
     try:
-        slider = SlidingWindowsFuzzy(
-            [state["windowHeight"], state["windowWidth"]],
-            [state["overlapY"], state["overlapX"]],
-            state["borderStrategy"],
-        )
+        windows = plan_windows(image_info.height, image_info.width, state)
     except (ValueError, RuntimeError) as re:
         _handle_error_and_exit(api=api, task_id=task_id, msg=f"Wrong sliding window settings: {re}")
         return
@@ -139,129 +118,210 @@ def preview(api: sly.Api, task_id, context, state, app_logger):
         _handle_error_and_exit(api=api, task_id=task_id, msg=f"Unexpected error: {repr(e)}")
         return
 
-    img = api.image.download_np(image_info.id)
+    image_fields = [
+        {"field": "state.previewImageId", "payload": image_info.id},
+        {"field": "data.previewImageName", "payload": image_info.name},
+        {"field": "state.previewLoading", "payload": False},
+    ]
+    # same image with same settings was already rendered and uploaded
+    preview_key = get_preview_key(image_info.id, state)
+    cached = g.PREVIEW_RESULTS.get(preview_key)
+    if cached is not None:
+        api.task.set_fields(task_id, cached[0] + image_fields)
+        return
 
-    ann_json = api.annotation.download(image_info.id).annotation
-    ann = sly.Annotation.from_json(ann_json, g.PROJECT_META)
+    img, ann, scale = load_preview_source(api, image_info, state)
+    if scale == 1:
+        windows = plan_windows(img.shape[0], img.shape[1], state)
+    else:
+        windows = scale_windows(windows, scale)
 
-    if state["drawLabels"] is True:
-        if state["cleanLabels"] is True:
-            i = 0
-            label_id_to_area = {}
-            labels = []
-            for label in ann.labels:
-                label = label.clone(description=str(i))
-                label_id_to_area[i] = label.area
-                labels.append(label)
-                i += 1
-            ann = ann.clone(labels=labels)
-
-    h, w = img.shape[:2]
-    max_right = w - 1
-    max_bottom = h - 1
-    rectangles = []
-    for window in slider.get(img.shape[:2]):
-        rectangles.append(window)
-        max_right = max(max_right, window.right)
-        max_bottom = max(max_bottom, window.bottom)
-
-    if max_right > w or max_bottom > h:
-        sly.logger.debug(
-            "Padding", extra={"h": h, "w": w, "max_right": max_right, "max_bottom": max_bottom}
+    # windows outside of image content are not shown
+    windows = windows[get_content_mask(img, ann, windows, state, g.CONTENT_MASK_SIZE)]
+    if len(windows) == 0:
+        _handle_error_and_exit(
+            api=api, task_id=task_id, msg="No windows over image content, check content settings"
         )
-        img = pad_to_fixed_size(img, width=max_right, height=max_bottom)
-        # sly.image.write(os.path.join(app.data_dir, "padded.jpg"), img)
+        return
+
+    # image is downscaled and labels are drawn once, frames only composite the window
+    renderer = PreviewRenderer(img, ann, windows, state, g.MAX_VIDEO_HEIGHT)
+    frame_indices = select_frames(len(windows), g.MAX_PREVIEW_FRAMES)
+    if len(frame_indices) < len(windows):
+        sly.logger.info(f"Preview shows {len(frame_indices)} of {len(windows)} windows")
+
+    if state["previewMode"] == "overlay":
+        fields, remote_path = upload_overlay_preview(api, task_id, renderer, frame_indices)
+    else:
+        fields, remote_path = upload_video_preview(api, task_id, state, renderer, frame_indices)
+    api.task.set_fields(task_id, fields + image_fields)
+    # previews that are no longer cached are removed from team files
+    for _, evicted_path in g.PREVIEW_RESULTS.put(preview_key, (fields, remote_path)):
+        remove_remote_preview(api, evicted_path)
+
 
-    frame_img = img.copy()
-    resize_height = None
-    if frame_img.shape[0] > g.MAX_VIDEO_HEIGHT:
-        resize_height = g.MAX_VIDEO_HEIGHT
-        frame_img = resize_keep_aspect_by_height(frame_img.copy(), resize_height)
-    height, width, channels = frame_img.shape
+def remove_remote_preview(api: sly.Api, remote_path: str):
+    try:
+        api.file.remove(g.TEAM_ID, remote_path)
+    except Exception as e:
+        sly.logger.warn(f"Can not remove preview {remote_path}: {repr(e)}")
+
+
+def load_preview_source(api: sly.Api, image_info, state):
+    """Returns decoded image, annotation and their scale to the original image.
+
+    Sources are cached by image id, so changing settings does not download the image again.
+    """
+    streamed = is_streamed(image_info, state, g.STREAMING_MIN_PIXELS)
+    cached = g.PREVIEW_SOURCES.get((image_info.id, streamed))
+    if cached is not None:
+        return cached
+
+    ann_json = api.annotation.download(image_info.id).annotation
+    ann = sly.Annotation.from_json(ann_json, g.PROJECT_META)
+    if streamed:
+        # huge image is never decoded in memory: preview is rendered on a copy downscaled by bands
+        raw = download_raw(api, image_info, os.path.join(g.app.data_dir, "stream"))
+        try:
+            scale = min(1.0, g.MAX_VIDEO_HEIGHT / raw.height)
+            img = raw.read_scaled(scale)
+        finally:
+            raw.remove()
+        ann = ann.scale(scale)
+    else:
+        img = api.image.download_np(image_info.id)
+        scale = 1.0
+    g.PREVIEW_SOURCES.put((image_info.id, streamed), (img, ann, scale))
+    return img, ann, scale
 
+
+def upload_video_preview(
+    api: sly.Api, task_id, state, renderer: PreviewRenderer, frame_indices: np.ndarray
+):
     video_path = os.path.join(g.app.data_dir, "preview.mp4")
     sly.fs.ensure_base_path(video_path)
     sly.fs.silent_remove(video_path)
     video = cv2.VideoWriter(
-        video_path, cv2.VideoWriter_fourcc(*"VP90"), state["fps"], (width, height)
+        video_path, cv2.VideoWriter_fourcc(*"VP90"), state["fps"], renderer.frame_size
+    )
+    # frames are rendered without waiting for api calls, progress is sent by a background thread
+    progress = ProgressReporter(
+        partial(refresh_progress_preview, api, task_id),
+        total=len(frame_indices),
+        message="Rendering frames",
     )
-    report_every = max(5, math.ceil(len(rectangles) / 100))
-    progress = tqdm(desc="Rendering frames", total=len(rectangles))
-    refresh_progress_preview(api, task_id, progress)
-    for i, rect in enumerate(rectangles):
-        frame = img.copy()
-        if state["drawLabels"] is True:
-            crop_ann = ann.relative_crop(rect)
-            temp_crop_img = frame[rect.top : rect.bottom + 1, rect.left : rect.right + 1].copy()
-            if state["cleanLabels"] is True:
-                filtered_labels = []
-                for label in crop_ann.labels:
-                    full_area = label_id_to_area[int(label.description)]
-                    if full_area == 0:
-                        continue
-                    if label.area / full_area * 100 > state["cleanLabelsThreshold"]:
-                        filtered_labels.append(label)
-                crop_ann = crop_ann.clone(labels=filtered_labels)
-            crop_ann.draw_pretty(temp_crop_img, thickness=3)
-            frame[rect.top : rect.bottom + 1, rect.left : rect.right + 1] = temp_crop_img
-        rect: sly.Rectangle
-        rect.draw_contour(frame, [255, 0, 0], thickness=5)
-        if resize_height is not None:
-            frame = resize_keep_aspect_by_height(frame, resize_height)
-        # sly.image.write(os.path.join(app.data_dir, f"{i:05d}.jpg"), frame)
-        frame_bgr = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
-        video.write(frame_bgr)
+    with progress:
+        # frames are encoded in a separate thread while next ones are rendered
+        with BackgroundStage(
+            lambda frame: video.write(cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)),
+            maxsize=g.PREVIEW_QUEUE_SIZE,
+            name="video",
+        ) as encode_stage:
+            for window_index in frame_indices.tolist():
+                encode_stage.put(renderer.render(window_index))
+                progress.update(1)
+
+        progress.reset("Saving video file", total=1)
+        video.release()
+        progress.update(1)
 
+        progress.reset("Uploading video", total=1)
+        remote_video_path = os.path.join(
+            f"/sliding-window/{task_id}", f"preview_{next(g.PREVIEW_COUNTER)}.mp4"
+        )
+        file_info = api.file.upload(g.TEAM_ID, video_path, remote_video_path)
         progress.update(1)
-        if i % report_every == 0:
-            refresh_progress_preview(api, task_id, progress)
-
-    progress = tqdm(desc="Saving video file", total=1)
-    progress.update(1)
-    refresh_progress_preview(api, task_id, progress)
-    video.release()
-
-    progress = tqdm(desc="Uploading video", total=1)
-    progress.update(1)
-    refresh_progress_preview(api, task_id, progress)
-    remote_video_path = os.path.join(f"/sliding-window/{task_id}", "preview.mp4")
-    if api.file.exists(g.TEAM_ID, remote_video_path):
-        api.file.remove(g.TEAM_ID, remote_video_path)
-    file_info = api.file.upload(g.TEAM_ID, video_path, remote_video_path)
 
+    return [{"field": "data.videoUrl", "payload": file_info.storage_path}], remote_video_path
+
+
+def upload_overlay_preview(
+    api: sly.Api, task_id, renderer: PreviewRenderer, frame_indices: np.ndarray
+):
+    """One overview image and the list of windows, the GUI steps through them without a video.
+
+    Returns fields and the path of the image in team files, like upload_video_preview.
+    """
+    image_path = os.path.join(g.app.data_dir, "preview.jpg")
+    sly.fs.ensure_base_path(image_path)
+    sly.image.write(image_path, renderer.overview())
+    manifest = renderer.manifest(frame_indices)
+
+    remote_image_path = os.path.join(
+        f"/sliding-window/{task_id}", f"preview_{next(g.PREVIEW_COUNTER)}.jpg"
+    )
+    file_info = api.file.upload(g.TEAM_ID, image_path, remote_image_path)
     fields = [
-        {"field": "state.previewLoading", "payload": False},
-        {"field": "data.videoUrl", "payload": file_info.storage_path},
+        {"field": "data.previewImageUrl", "payload": file_info.storage_path},
+        {"field": "data.previewManifest", "payload": manifest},
+        {"field": "state.previewWindow", "payload": 0},
     ]
-    api.task.set_fields(task_id, fields)
+    return fields, remote_image_path
 
 
-def refresh_progress_split(api: sly.Api, task_id, progress: tqdm):
+def refresh_progress_split(api: sly.Api, task_id, snapshot: ProgressSnapshot):
     fields = [
-        {"field": "data.progress", "payload": int(progress.n * 100 / progress.total)},
-        {"field": "data.progressCurrent", "payload": progress.n},
-        {"field": "data.progressTotal", "payload": progress.total},
+        {"field": "data.progress", "payload": int(snapshot.current * 100 / max(snapshot.total, 1))},
+        {"field": "data.progressCurrent", "payload": snapshot.current},
+        {"field": "data.progressTotal", "payload": snapshot.total},
+        {"field": "data.progressSpeed", "payload": format_speed(snapshot, "images", "tiles")},
     ]
     api.task.set_fields(task_id, fields)
 
 
+@g.app.callback("plan")
+@sly.timeit
+def plan(api: sly.Api, task_id, context, state, app_logger):
+    split_plan = None
+    try:
+        g.IMAGES_INDEX.wait_ready()
+        dataset_names = {
+            dataset.id: dataset.name for dataset in get_project_datasets(api, g.PROJECT_ID)
+        }
+        try:
+            split_plan = planner.plan_split(
+                g.IMAGES_INDEX.table(),
+                state,
+                dataset_names,
+                g.FETCH_BATCH_SIZE,
+                g.FETCH_BATCH_BYTES,
+                g.UPLOAD_BATCH_SIZE,
+                g.UPLOAD_BATCH_BYTES,
+                g.STREAMING_MIN_PIXELS,
+                throughput=planner.load_throughput(g.app.cache_dir),
+            )
+        except (ValueError, RuntimeError) as e:
+            sly.logger.warn(f"Wrong sliding window settings: {e}", exc_info=True)
+            g.app.show_modal_window(
+                f"Wrong sliding window settings: {e}", level="error", log_message=False
+            )
+    except Exception as e:
+        # images or datasets can not be listed
+        sly.logger.warn(f"Can not estimate split: {repr(e)}", exc_info=True)
+        g.app.show_modal_window(
+            f"Can not estimate split: {repr(e)}", level="error", log_message=False
+        )
+    finally:
+        fields = [
+            {"field": "data.plan", "payload": split_plan},
+            {"field": "state.planLoading", "payload": False},
+        ]
+        api.task.set_fields(task_id, fields)
+
+
 @g.app.callback("split")
 @sly.timeit
 def split(api: sly.Api, task_id, context, state, app_logger):
-    if len(g.IMAGES_INFO) == 0:
+    # decoded preview images are not needed anymore, memory is used by the split pipeline
+    g.PREVIEW_SOURCES.clear()
+    g.IMAGES_INDEX.wait_ready()
+    if len(g.IMAGES_INDEX) == 0:
         message = f"Project {g.PROJECT_INFO.name} has no images"
         description = "Please, check your project and try again."
         api.task.set_output_error(task_id, message, description)
         g.app.show_modal_window(message, level="error")
         g.app.stop()
         return
-    image_info = random.choice(g.IMAGES_INFO)
-    get_sliding_windows_sizes(image_info=image_info, state=state)
-    # slider = SlidingWindowsFuzzy(
-    #     [state["windowHeight"], state["windowWidth"]],
-    #     [state["overlapY"], state["overlapX"]],
-    #     state["borderStrategy"],
-    # )
 
     dst_project = api.project.create(
         g.WORKSPACE_ID, state["resProjectName"], change_name_if_conflict=True
@@ -288,6 +348,16 @@ def split(api: sly.Api, task_id, context, state, app_logger):
             "overlapY": overlapY,
             "overlapX": overlapX,
             "borderStrategy": state["borderStrategy"],
+            "tileFormat": state["tileCodec"],
+            "pyramidScales": get_scales(state),
+            "pyramidOutput": state["pyramidOutput"],
+        },
+        "tileFilter": {
+            "windowPlacement": state["windowPlacement"],
+            "emptyTiles": state["emptyTiles"],
+            "emptyTilesPercent": state["emptyTilesPercent"],
+            "skipUniformTiles": state["skipUniformTiles"],
+            "uniformTilesMaxStd": state["uniformTilesMaxStd"],
         },
         "taskId": task_id,
     }
@@ -296,22 +366,17 @@ def split(api: sly.Api, task_id, context, state, app_logger):
         dst_project.id,
         data=custom_data,
     )
+    src_datasets = {}
     dst_datasets = {}
+    images_without_tiles = {}
+    scales = get_scales(state)
+    levels_to_datasets = state["pyramidOutput"] == "dataset"
 
-    progress = tqdm(desc="Splitting images", total=len(g.IMAGES_INFO))
-
-    state_backup = deepcopy(state)
-
-    for image_info in g.IMAGES_INFO:
-        get_sliding_windows_sizes(image_info=image_info, state=state)
-        check_sliding_sizes_by_image(img_info=image_info, state=state)
-
+    # windows depend only on image size, grids are validated and memoized per distinct size
+    images_table = g.IMAGES_INDEX.table()
+    for (height, width), scale in itertools.product(images_table.sizes().tolist(), scales):
         try:
-            slider = SlidingWindowsFuzzy(
-                [state["windowHeight"], state["windowWidth"]],
-                [state["overlapY"], state["overlapX"]],
-                state["borderStrategy"],
-            )
+            plan_windows(*get_level_size(height, width, scale), state)
         except (ValueError, RuntimeError) as re:
             _handle_error_and_exit(
                 api=api, task_id=task_id, msg=f"Wrong sliding window settings: {re}"
@@ -321,101 +386,229 @@ def split(api: sly.Api, task_id, context, state, app_logger):
             _handle_error_and_exit(api=api, task_id=task_id, msg=f"Unexpected error: {repr(e)}")
             return
 
-        if image_info.dataset_id not in dst_datasets:
-            dataset_info = api.dataset.get_info_by_id(image_info.dataset_id)
-            dst_datasets[image_info.dataset_id] = api.dataset.create(
-                dst_project.id, dataset_info.name, dataset_info.description
+    # crops of images with the same merged name would get the same names in one dataset
+    merged_names = {}
+    for entry in images_table.iter_entries():
+        key = (entry.dataset_id, get_merged_name(entry.name, get_tile_ext(entry.name, state)))
+        if key in merged_names:
+            _handle_error_and_exit(
+                api=api,
+                task_id=task_id,
+                msg=f"Images {merged_names[key]!r} and {entry.name!r} of one dataset would get "
+                f"the same crop names {key[1]!r}. Please, rename one of them or keep the source "
+                "output format.",
             )
-        dst_dataset = dst_datasets[image_info.dataset_id]
+            return
+        merged_names[key] = entry.name
+    del merged_names
+
+    def _download(batch):
+        dataset_id = batch[0].dataset_id
+        image_ids = [image_info.id for image_info in batch]
+        ann_infos = api.annotation.download_batch(dataset_id, image_ids)
+        # huge images are downloaded to local disk and later read by bands of windows
+        streamed = [is_streamed(image_info, state, g.STREAMING_MIN_PIXELS) for image_info in batch]
+        in_memory_ids = [image_info.id for image_info, s in zip(batch, streamed) if not s]
+        in_memory_imgs = api.image.download_nps(dataset_id, in_memory_ids)
+        if worker_pool is not None:
+            # decoded images are moved to shared memory one by one, workers read them from there
+            for i in range(len(in_memory_imgs)):
+                in_memory_imgs[i] = worker_pool.share(in_memory_imgs[i])
+        in_memory_imgs = iter(in_memory_imgs)
+        imgs = [
+            download_raw(api, image_info, stream_dir) if s else next(in_memory_imgs)
+            for image_info, s in zip(batch, streamed)
+        ]
+        return [
+            (image_info, img, sly.Annotation.from_json(ann_info.annotation, g.PROJECT_META))
+            for image_info, img, ann_info in zip(batch, imgs, ann_infos)
+        ]
+
+    def _process(img, ann, windows, image_name, row_offset=0, keep_empty=None):
+        if worker_pool is not None:
+            return worker_pool.process(image_name, img, ann, windows, state, row_offset, keep_empty)
+        # tiles are encoded in parallel, cv2.imencode releases the GIL
+        return process_windows(
+            image_name,
+            img,
+            ann,
+            windows,
+            state,
+            encode_pool.map,
+            row_offset=row_offset,
+            keep_empty=keep_empty,
+        )
 
-        img = api.image.download_np(image_info.id)
-        ann_json = api.annotation.download(image_info.id).annotation
-        ann = sly.Annotation.from_json(ann_json, g.PROJECT_META)
-
-        if state["cleanLabels"] is True:
-            # create temporary annotation (set index as description for each label)
-            i = 0
-            label_id_to_area = {}
-            labels = []
-            for label in ann.labels:
-                label = label.clone(description=str(i))
-                label_id_to_area[i] = label.area
-                labels.append(label)
-                i += 1
-            new_ann = ann.clone(labels=labels)
-
-        crop_names = []
-        crop_images = []
-        crop_anns = []
-
-        for window_index, window in enumerate(slider.get(img.shape[:2])):
-            safe_base_name = sly.fs.get_file_name(image_info.name).replace("___", "__")
-            if window_index == 0:
-                crop_name = "{}___{:04d}_{}_{}_dims_{}x{}{}".format(
-                    safe_base_name,
-                    window_index,
-                    window.top,
-                    window.left,
-                    img.shape[0],
-                    img.shape[1],
-                    sly.fs.get_file_ext(image_info.name),
-                )
-            else:
-                crop_name = "{}___{:04d}_{}_{}{}".format(
-                    safe_base_name,
-                    window_index,
-                    window.top,
-                    window.left,
-                    sly.fs.get_file_ext(image_info.name),
+    def _crop_level(image_info, scale, image_name, img, ann):
+        """Crops one pyramid level, tiles are queued for upload as soon as a band of windows is
+        processed. Returns the merged image record if all windows were skipped.
+        """
+        height, width = img.shape[:2]
+        windows = plan_windows(height, width, state)
+        tile_ext = get_tile_ext(image_name, state)
+        # only grid windows over image content are processed, grid indices are kept in names
+        placed = np.flatnonzero(get_content_mask(img, ann, windows, state, g.CONTENT_MASK_SIZE))
+        placed_windows = windows[placed]
+        keep_empty = get_empty_keep_mask(image_name, len(windows), state)[placed]
+        if isinstance(img, RawImage):
+            # only one band of windows is in memory at a time
+            # with worker processes bands are read straight into shared memory
+            bands = (
+                (top, band, placed_windows[:, 0] == top)
+                for top, band, _ in iter_bands(
+                    img, placed_windows, None if worker_pool is None else worker_pool.empty
                 )
+            )
+        elif len(placed) > 0:
+            bands = [(0, img, np.ones(len(placed), dtype=bool))]
+        else:
+            bands = []
 
-            crop_ann = ann.relative_crop(window)
-            if state["cleanLabels"] is True:
-                # will use temporary annotation to match labels areas with same labels in full image
-                temp_crop = new_ann.relative_crop(window)
-
-                filtered_labels = []
-                for label, temp_label in zip(
-                    crop_ann.labels, temp_crop.labels
-                ):  # labels are in the same order
-                    full_area = label_id_to_area[int(temp_label.description)]
-                    if full_area == 0:
-                        continue
-                    if label.area / full_area * 100 > state["cleanLabelsThreshold"]:
-                        filtered_labels.append(label)
-                crop_ann = crop_ann.clone(labels=filtered_labels)
-
-            if state["borderStrategy"] == str(SlidingWindowBorderStrategy.ADD_PADDING):
-                crop_image = sly.image.crop_with_padding(img, window)
-            else:
-                crop_image = sly.image.crop(img, window)
-            if state["resizeWindow"] is True:
-                resized_image = resize_keep_aspect_by_height(
-                    crop_image.copy(), state["resizeValue"]
+        tiles_count = 0
+        for top, band, in_band in bands:
+            crop_blobs, crop_anns, band_kept = _process(
+                band, ann, placed_windows[in_band], image_name, top, keep_empty[in_band]
+            )
+            if worker_pool is not None and band is not img:
+                worker_pool.release(band)
+            del band
+            indices = placed[in_band][band_kept]
+            # the first kept crop of the level has image dimensions in its name
+            crop_names = get_crop_names(
+                image_name,
+                windows[indices],
+                height,
+                width,
+                ext=tile_ext,
+                indices=indices,
+                add_dims=tiles_count == 0,
+            )
+            tiles_count += len(crop_names)
+            if len(crop_names) > 0:
+                upload_stage.put(
+                    partial(
+                        _upload_tiles,
+                        image_info.dataset_id,
+                        scale,
+                        crop_names,
+                        crop_blobs,
+                        crop_anns,
+                    )
                 )
-                try:
-                    resized_ann = crop_ann.resize(resized_image.shape[:2])
-                    crop_anns.append(resized_ann)
-                    crop_images.append(resized_image)
-                except Exception as e:
-                    sly.logger.warn(f"Can not resize {image_info.name} image and annotations.")
-                    crop_images.append(crop_image)
-                    crop_anns.append(crop_ann)
-            else:
-                crop_images.append(crop_image)
-                crop_anns.append(crop_ann)
-
-            crop_names.append(crop_name)
-
-        dst_image_infos = api.image.upload_nps(dst_dataset.id, crop_names, crop_images)
-        dst_image_ids = [dst_img_info.id for dst_img_info in dst_image_infos]
-        api.annotation.upload_anns(dst_image_ids, crop_anns)
-
+            del crop_blobs, crop_anns
+
+        # only images without any crop are recorded for merge
+        if tiles_count > 0:
+            return None
+        return {"name": get_merged_name(image_name, tile_ext), "height": height, "width": width}
+
+    def _crop(item):
+        image_info, img, ann = item
+        empty_images = []
+        # image is decoded once, every pyramid level is downscaled from the previous one
+        image_levels = iter_levels(img, ann, scales)
+        try:
+            for scale, level_img, level_ann in image_levels:
+                # levels go to datasets with scale suffix or have the suffix in crop names
+                level_name = image_info.name
+                if not levels_to_datasets:
+                    level_name = get_level_name(image_info.name, scale)
+                empty_image = _crop_level(image_info, scale, level_name, level_img, level_ann)
+                if empty_image is not None:
+                    empty_images.append((scale, empty_image))
+                del level_img
+        finally:
+            image_levels.close()
+            if isinstance(img, RawImage):
+                img.remove()
+            elif worker_pool is not None:
+                worker_pool.release(img)
+        upload_stage.put(partial(_finish_image, image_info.dataset_id, empty_images))
+
+    def _get_dst_dataset(dataset_id, scale):
+        if not levels_to_datasets:
+            scale = 1
+        if (dataset_id, scale) not in dst_datasets:
+            if dataset_id not in src_datasets:
+                src_datasets[dataset_id] = api.dataset.get_info_by_id(dataset_id)
+            dataset_info = src_datasets[dataset_id]
+            dst_datasets[(dataset_id, scale)] = api.dataset.create(
+                dst_project.id,
+                dataset_info.name + get_scale_suffix(scale),
+                dataset_info.description,
+            )
+        return dst_datasets[(dataset_id, scale)]
+
+    # upload tasks are run in order by the upload thread, tiles of an image are queued before
+    # the task that finishes the image
+    def _upload_tiles(dataset_id, scale, crop_names, crop_blobs, crop_anns):
+        dst_dataset = _get_dst_dataset(dataset_id, scale)
+        uploader.add(dst_dataset.id, crop_names, crop_blobs, crop_anns)
+
+    def _finish_image(dataset_id, empty_images):
+        for scale, empty_image in empty_images:
+            # merge uploads black images of the original size for images without crops
+            dst_dataset = _get_dst_dataset(dataset_id, scale)
+            dataset_images = images_without_tiles.setdefault(str(dst_dataset.id), {})
+            dataset_images[empty_image.pop("name")] = empty_image
         progress.update(1)
-        refresh_progress_split(api, task_id, progress)
 
-        state = deepcopy(state_backup)
+    stream_dir = os.path.join(g.app.data_dir, "stream")
+    # images are counted when they are processed, tiles when they are uploaded,
+    # progress is sent by a background thread
+    progress = ProgressReporter(
+        partial(refresh_progress_split, api, task_id),
+        total=len(images_table),
+        message="Splitting images",
+    )
+    # tiles of different source images are uploaded together in batches limited by size
+    uploader = UploadAccumulator(
+        api,
+        g.UPLOAD_BATCH_SIZE,
+        g.UPLOAD_BATCH_BYTES,
+        on_uploaded=lambda tiles_count: progress.update(0, tiles=tiles_count),
+    )
 
+    # download -> crop -> upload stages run concurrently, queues are bounded to cap memory usage.
+    # With several worker processes, windows of every image are sharded across them. Workers are
+    # forked before the progress reporter and the pipeline threads of the split are started, so
+    # no thread of the split holds a logging or http lock while forking.
+    with (
+        SharedMemoryPool(state["workersCount"], g.PROJECT_META)
+        if state["workersCount"] > 1
+        else nullcontext()
+    ) as worker_pool, progress:
+        with ThreadPoolExecutor(
+            max_workers=g.DOWNLOAD_WORKERS, thread_name_prefix="download"
+        ) as download_pool, ThreadPoolExecutor(
+            max_workers=g.CROP_WORKERS, thread_name_prefix="crop"
+        ) as crop_pool, ThreadPoolExecutor(
+            max_workers=g.ENCODE_WORKERS, thread_name_prefix="encode"
+        ) as encode_pool, BackgroundStage(
+            lambda upload_task: upload_task(), maxsize=g.UPLOAD_QUEUE_SIZE, name="upload"
+        ) as upload_stage:
+            batches = batch_by_dataset(
+                images_table.iter_by_dataset(), g.FETCH_BATCH_SIZE, g.FETCH_BATCH_BYTES
+            )
+            downloaded = (
+                item
+                for batch in imap_bounded(
+                    download_pool, _download, batches, depth=g.PREFETCH_BATCHES
+                )
+                for item in batch
+            )
+            # crop threads queue tiles for upload band by band, so at most one band per crop
+            # thread, the upload queue and one upload batch per dataset are in memory
+            for _ in imap_bounded(crop_pool, _crop, downloaded, depth=g.CROP_WORKERS):
+                pass
+        # last batches are uploaded before the progress is closed, so measured throughput counts them
+        uploader.flush()
+    if len(images_without_tiles) > 0:
+        custom_data["tileFilter"]["imagesWithoutTiles"] = images_without_tiles
+        api.project.update_custom_data(dst_project.id, data=custom_data)
+    # measured throughput is used by the planner in next sessions
+    snapshot = progress.snapshot()
+    planner.save_throughput(g.app.cache_dir, snapshot.items_per_sec, snapshot.tiles_per_sec)
     res_project = api.project.get_info_by_id(dst_project.id)
     fields = [
         {"field": "data.started", "payload": False},
@@ -440,10 +633,16 @@ def main():
     init_ui.init_res_project(data, state, g.PROJECT_INFO)
 
     data["videoUrl"] = None
+    data["previewImageUrl"] = None
+    data["previewManifest"] = None
+    state["previewWindow"] = 0
+    state["previewImageId"] = None
+    data["previewImageName"] = None
 
     data["progress"] = 0
     data["progressCurrent"] = 0
     data["progressTotal"] = 0
+    data["progressSpeed"] = ""
 
     state["previewLoading"] = False
     data["progressPreview"] = 0
@@ -451,9 +650,16 @@ def main():
     data["progressPreviewCurrent"] = 0
     data["progressPreviewTotal"] = 0
 
-    cache_images_info(g.app.public_api, g.PROJECT_ID)
+    state["planLoading"] = False
+    data["plan"] = None
+
+    data["indexedImagesCount"] = 0
+    data["indexReady"] = False
+
+    # UI starts immediately, images are listed in background once the session is initialized
+    g.IMAGES_INDEX = ProjectIndex()
     asyncio.set_event_loop(asyncio.new_event_loop())
-    g.app.run(data=data, state=state)
+    g.app.run(data=data, state=state, initial_events=[{"command": "index_images"}])
 
 
 # https://github.com/supervisely/supervisely/tree/master/plugins/python/src/examples/001_image_splitter
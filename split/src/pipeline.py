@@ -0,0 +1,108 @@
+import queue
+import threading
+from collections import deque
+from concurrent.futures import Executor
+
+_STOP = object()
+
+
+def imap_bounded(executor: Executor, func, iterable, depth: int):
+    """Like executor.map, but keeps at most `depth` tasks in flight and yields results in order.
+
+    Input items are pulled lazily, so the producer is throttled by the consumer (backpressure).
+    """
+    pending = deque()
+    try:
+        for item in iterable:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= depth:
+                yield pending.popleft().result()
+        while len(pending) > 0:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+class BackgroundStage:
+    """Runs `func` for every item put into a bounded queue in a separate thread.
+
+    `put` blocks when the queue is full, so a slow stage throttles the producer.
+    An error raised in the background thread is re-raised in the producer on the next `put`/`close`.
+    """
+
+    def __init__(self, func, maxsize: int, name: str = None):
+        self._func = func
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            if self._error is not None:
+                continue  # drain the queue after a failure, producer will stop on next put
+            try:
+                self._func(item)
+            except Exception as e:
+                self._error = e
+
+    def _raise_if_failed(self):
+        if self._error is not None:
+            raise self._error
+
+    def put(self, item):
+        while True:
+            self._raise_if_failed()
+            try:
+                self._queue.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def close(self):
+        self._queue.put(_STOP)
+        self._thread.join()
+        self._raise_if_failed()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+            return
+        # producer failed: stop the thread without masking the original exception
+        self._error = self._error or exc_value
+        self._queue.put(_STOP)
+        self._thread.join()
+
+
+def batch_by_dataset(image_infos, max_items: int, max_bytes: int, key=None):
+    """Yields batches of images of one dataset limited by items count and decoded size in bytes.
+
+    Input is consumed lazily and should be grouped by dataset: a batch is closed whenever
+    the dataset changes. `key` extracts ImageInfo from an item (item itself by default).
+    An image larger than `max_bytes` forms a batch of its own.
+    """
+    key = key or (lambda item: item)
+    batch = []
+    batch_bytes = 0
+    for item in image_infos:
+        image_info = key(item)
+        item_bytes = (image_info.width or 0) * (image_info.height or 0) * 3
+        if len(batch) > 0 and (
+            key(batch[0]).dataset_id != image_info.dataset_id
+            or len(batch) >= max_items
+            or batch_bytes + item_bytes > max_bytes
+        ):
+            yield batch
+            batch = []
+            batch_bytes = 0
+        batch.append(item)
+        batch_bytes += item_bytes
+    if len(batch) > 0:
+        yield batch
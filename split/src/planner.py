@@ -0,0 +1,196 @@
+import json
+import math
+import os
+
+import numpy as np
+from pipeline import batch_by_dataset
+from project_index import ImagesTable
+from pyramid import get_level_size, get_scales
+import supervisely as sly
+from streaming import is_streamed
+from tiles import get_resized_size, get_tile_ext
+from windows import plan_windows
+
+# rough size of encoded tiles in bytes per pixel of RGB image
+BYTES_PER_PIXEL = {".jpg": 0.4, ".jpeg": 0.4, ".png": 1.8, ".webp": 0.3}
+DEFAULT_BYTES_PER_PIXEL = 3.0
+
+# thresholds of settings warnings
+MAX_TOTAL_TILES = 1_000_000
+MAX_IMAGE_TILES = 10_000
+MIN_WINDOW_SIDE = 32
+MAX_OUTPUT_PIXELS_RATIO = 4
+
+
+def _get_throughput_path(cache_dir: str) -> str:
+    return os.path.join(cache_dir, "split_throughput.json")
+
+
+def load_throughput(cache_dir: str) -> dict:
+    """Returns throughput measured by the last finished split or None."""
+    path = _get_throughput_path(cache_dir)
+    if not os.path.isfile(path):
+        return None
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except Exception as e:
+        sly.logger.warn(f"Can not read measured throughput {path}: {repr(e)}")
+        return None
+
+
+def save_throughput(cache_dir: str, images_per_sec: float, tiles_per_sec: float):
+    path = _get_throughput_path(cache_dir)
+    try:
+        sly.fs.ensure_base_path(path)
+        with open(path, "w") as f:
+            json.dump({"imagesPerSec": images_per_sec, "tilesPerSec": tiles_per_sec}, f)
+    except Exception as e:
+        sly.logger.warn(f"Can not save measured throughput {path}: {repr(e)}")
+
+
+def _get_windows_stats(sizes: np.ndarray, state: dict):
+    """Windows count, output pixels and minimal window side for every distinct image size."""
+    counts = np.zeros(len(sizes), dtype=np.int64)
+    pixels = np.zeros(len(sizes), dtype=np.int64)
+    min_side = math.inf
+    for i, (height, width) in enumerate(sizes.tolist()):
+        windows = plan_windows(height, width, state)
+        heights = windows[:, 2] - windows[:, 0] + 1
+        widths = windows[:, 3] - windows[:, 1] + 1
+        min_side = min(min_side, int(heights.min()), int(widths.min()))
+        if state["resizeWindow"] is True:
+            resized = [
+                get_resized_size(h, w, state["resizeValue"]) for h, w in zip(heights, widths)
+            ]
+            heights, widths = np.array(resized, dtype=np.int64).reshape(-1, 2).T
+        counts[i] = len(windows)
+        pixels[i] = int((heights * widths).sum())
+    return counts, pixels, min_side
+
+
+def _get_warnings(state, total_tiles, max_image_tiles, min_side, input_pixels, output_pixels):
+    warnings = []
+    if total_tiles > MAX_TOTAL_TILES:
+        warnings.append(f"Split will produce {total_tiles} tiles in total")
+    if max_image_tiles > MAX_IMAGE_TILES:
+        warnings.append(f"Some images will be split into {max_image_tiles} tiles")
+    if min_side < MIN_WINDOW_SIDE:
+        warnings.append(f"Some windows are only {min_side} px wide or high")
+    if input_pixels > 0 and output_pixels > MAX_OUTPUT_PIXELS_RATIO * input_pixels:
+        ratio = output_pixels / input_pixels
+        warnings.append(
+            f"Tiles have {ratio:.1f}x more pixels than source images, check overlap and resize"
+        )
+    if state["resizeWindow"] is True and state["resizeValue"] <= 0:
+        warnings.append("Resize height should be positive")
+    return warnings
+
+
+def plan_split(
+    table: ImagesTable,
+    state: dict,
+    dataset_names: dict,
+    fetch_batch_size: int,
+    fetch_batch_bytes: int,
+    upload_batch_size: int,
+    upload_batch_bytes: int,
+    streaming_min_pixels: int,
+    throughput: dict = None,
+) -> dict:
+    """Estimates split results only from image sizes, nothing is downloaded.
+
+    Raises the same errors as plan_windows for wrong settings.
+    """
+    image_sizes = np.stack([table.heights, table.widths], axis=1).astype(np.int64)
+    sizes, size_index = np.unique(image_sizes, axis=0, return_inverse=True)
+    size_index = size_index.reshape(-1)
+    image_tiles = np.zeros(len(table), dtype=np.int64)
+    image_pixels = np.zeros(len(table), dtype=np.int64)
+    min_side = math.inf
+    for scale in get_scales(state):
+        level_sizes = [get_level_size(height, width, scale) for height, width in sizes.tolist()]
+        counts, pixels, level_min_side = _get_windows_stats(
+            np.array(level_sizes, dtype=np.int64).reshape(-1, 2), state
+        )
+        image_tiles += counts[size_index]
+        image_pixels += pixels[size_index]
+        min_side = min(min_side, level_min_side)
+
+    if state["tileCodec"] == "source":
+        exts = [sly.fs.get_file_ext(table.name(i)).lower() for i in range(len(table))]
+    else:
+        exts = [get_tile_ext("", state)] * len(table)
+    bytes_per_pixel = np.array([BYTES_PER_PIXEL.get(ext, DEFAULT_BYTES_PER_PIXEL) for ext in exts])
+    image_bytes = image_pixels * bytes_per_pixel
+
+    streamed = np.array(
+        [is_streamed(entry, state, streaming_min_pixels) for entry in table.iter_entries()],
+        dtype=bool,
+    )
+
+    # download batches are counted exactly as the split pipeline makes them
+    download_calls = {}
+    for batch in batch_by_dataset(table.iter_by_dataset(), fetch_batch_size, fetch_batch_bytes):
+        dataset_id = batch[0].dataset_id
+        batch_streamed = sum(1 for e in batch if is_streamed(e, state, streaming_min_pixels))
+        # annotations, in-memory images and one request per streamed image
+        calls = 1 + (1 if batch_streamed < len(batch) else 0) + batch_streamed
+        download_calls[dataset_id] = download_calls.get(dataset_id, 0) + calls
+
+    dataset_ids, dataset_index = np.unique(table.dataset_ids, return_inverse=True)
+    dataset_index = dataset_index.reshape(-1)
+
+    def _per_dataset(values):
+        return np.bincount(dataset_index, weights=values, minlength=len(dataset_ids))
+
+    ds_images = np.bincount(dataset_index, minlength=len(dataset_ids))
+    ds_tiles = _per_dataset(image_tiles)
+    ds_pixels = _per_dataset(image_pixels)
+    ds_bytes = _per_dataset(image_bytes)
+
+    datasets = []
+    total_calls = 0
+    for i, dataset_id in enumerate(dataset_ids.tolist()):
+        tiles = int(ds_tiles[i])
+        upload_batches = max(
+            math.ceil(tiles / upload_batch_size), math.ceil(ds_bytes[i] / upload_batch_bytes)
+        )
+        # dataset info and creation, then data, hashes and annotations per upload batch
+        calls = download_calls.get(dataset_id, 0) + 2 + 3 * upload_batches
+        total_calls += calls
+        datasets.append(
+            {
+                "name": dataset_names.get(dataset_id, str(dataset_id)),
+                "images": int(ds_images[i]),
+                "tiles": tiles,
+                "megapixels": round(ds_pixels[i] / 1e6, 1),
+                "megabytes": round(ds_bytes[i] / 2**20, 1),
+                "apiCalls": calls,
+            }
+        )
+
+    total_tiles = int(image_tiles.sum())
+    eta = None
+    if throughput is not None and throughput.get("tilesPerSec", 0) > 0:
+        minutes, seconds = divmod(round(total_tiles / throughput["tilesPerSec"]), 60)
+        eta = "{}:{:02d}:{:02d}".format(minutes // 60, minutes % 60, seconds)
+
+    input_pixels = int((image_sizes[:, 0] * image_sizes[:, 1]).sum())
+    output_pixels = int(image_pixels.sum())
+    max_image_tiles = int(image_tiles.max()) if len(image_tiles) > 0 else 0
+    return {
+        "datasets": datasets,
+        "total": {
+            "images": len(table),
+            "tiles": total_tiles,
+            "megapixels": round(output_pixels / 1e6, 1),
+            "megabytes": round(float(image_bytes.sum()) / 2**20, 1),
+            "apiCalls": total_calls,
+        },
+        "streamedImages": int(streamed.sum()),
+        "eta": eta,
+        "warnings": _get_warnings(
+            state, total_tiles, max_image_tiles, min_side, input_pixels, output_pixels
+        ),
+    }
@@ -0,0 +1,93 @@
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable, List
+
+# settings that change the rendered preview, fps is used only by the video
+WINDOW_SETTINGS = [
+    "usePercents",
+    "useSquare",
+    "windowHeightPx",
+    "windowWidthPx",
+    "overlapYPx",
+    "overlapXPx",
+    "windowHeightPercent",
+    "windowWidthPercent",
+    "overlapYPercent",
+    "overlapXPercent",
+    "borderStrategy",
+    "windowPlacement",
+    "contentMinStd",
+    "contentMinPercent",
+    "keepLabeledWindows",
+]
+
+
+class LRUCache:
+    """Thread-safe mapping that keeps at most `maxsize` recently used items.
+
+    With `maxbytes`, the total `sizeof(value)` of items is limited too; an item larger than the
+    limit is not kept at all.
+    """
+
+    def __init__(self, maxsize: int, maxbytes: int = None, sizeof: Callable[[object], int] = None):
+        self._maxsize = maxsize
+        self._maxbytes = maxbytes
+        self._sizeof = sizeof
+        self._items = OrderedDict()
+        self._sizes = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default=None):
+        with self._lock:
+            if key not in self._items:
+                return default
+            self._items.move_to_end(key)
+            return self._items[key]
+
+    def put(self, key: Hashable, value) -> List[object]:
+        """Returns evicted values, so the caller can release resources they hold."""
+        evicted = []
+        with self._lock:
+            if key in self._items:
+                self._bytes -= self._sizes.pop(key)
+                old_value = self._items.pop(key)
+                if old_value is not value:
+                    evicted.append(old_value)
+            self._items[key] = value
+            self._sizes[key] = self._sizeof(value) if self._sizeof is not None else 0
+            self._bytes += self._sizes[key]
+            while len(self._items) > self._maxsize or (
+                self._maxbytes is not None and self._bytes > self._maxbytes
+            ):
+                old_key, old_value = self._items.popitem(last=False)
+                self._bytes -= self._sizes.pop(old_key)
+                evicted.append(old_value)
+        return evicted
+
+    def clear(self) -> List[object]:
+        """Removes all items and returns their values."""
+        with self._lock:
+            values = list(self._items.values())
+            self._items.clear()
+            self._sizes.clear()
+            self._bytes = 0
+        return values
+
+    def __len__(self):
+        with self._lock:
+            return len(self._items)
+
+
+def get_preview_key(image_id: int, state: dict) -> tuple:
+    """Key of a rendered preview: image, window settings and visualization options."""
+    clean_threshold = state["cleanLabelsThreshold"] if state["cleanLabels"] is True else None
+    fps = state["fps"] if state["previewMode"] == "video" else None
+    return (
+        image_id,
+        tuple(state[name] for name in WINDOW_SETTINGS),
+        state["previewMode"],
+        state["drawLabels"] is True,
+        clean_threshold,
+        fps,
+    )
@@ -0,0 +1,286 @@
+import os
+import random
+import threading
+from collections import namedtuple
+from concurrent.futures import as_completed, ThreadPoolExecutor
+from typing import Callable, Iterator, List, Optional
+
+import numpy as np
+from sliding_window.progress import ProgressReporter
+import supervisely as sly
+
+# the only image fields used by split and preview
+ImageEntry = namedtuple("ImageEntry", ["id", "dataset_id", "name", "width", "height"])
+
+
+def get_project_datasets(api: sly.Api, project_id):
+    try:
+        return api.dataset.get_list(project_id, recursive=True)
+    except TypeError:
+        return api.dataset.get_list(project_id)
+
+
+class ImagesTable:
+    """Columnar table of images: ids, dataset ids and sizes are numpy arrays, names are packed
+    into one utf-8 buffer with offsets. ImageEntry tuples are created only on access.
+    """
+
+    def __init__(
+        self,
+        ids: np.ndarray,
+        dataset_ids: np.ndarray,
+        widths: np.ndarray,
+        heights: np.ndarray,
+        names_data: np.ndarray,
+        name_offsets: np.ndarray,
+    ):
+        self.ids = ids
+        self.dataset_ids = dataset_ids
+        self.widths = widths
+        self.heights = heights
+        self._names_data = names_data
+        self._name_offsets = name_offsets
+
+    @classmethod
+    def from_infos(cls, image_infos) -> "ImagesTable":
+        names = [info.name.encode("utf-8") for info in image_infos]
+        name_offsets = np.zeros(len(names) + 1, dtype=np.int64)
+        np.cumsum([len(name) for name in names], out=name_offsets[1:])
+        return cls(
+            np.array([info.id for info in image_infos], dtype=np.int64),
+            np.array([info.dataset_id for info in image_infos], dtype=np.int64),
+            np.array([info.width or 0 for info in image_infos], dtype=np.int32),
+            np.array([info.height or 0 for info in image_infos], dtype=np.int32),
+            np.frombuffer(b"".join(names), dtype=np.uint8),
+            name_offsets,
+        )
+
+    @classmethod
+    def concatenate(cls, tables: List["ImagesTable"]) -> "ImagesTable":
+        if len(tables) == 1:
+            return tables[0]
+        if len(tables) == 0:
+            return cls.from_infos([])
+        name_offsets = [tables[0]._name_offsets]
+        shift = tables[0]._name_offsets[-1]
+        for table in tables[1:]:
+            name_offsets.append(table._name_offsets[1:] + shift)
+            shift += table._name_offsets[-1]
+        return cls(
+            np.concatenate([table.ids for table in tables]),
+            np.concatenate([table.dataset_ids for table in tables]),
+            np.concatenate([table.widths for table in tables]),
+            np.concatenate([table.heights for table in tables]),
+            np.concatenate([table._names_data for table in tables]),
+            np.concatenate(name_offsets),
+        )
+
+    def __len__(self):
+        return len(self.ids)
+
+    def name(self, i: int) -> str:
+        start, end = self._name_offsets[i], self._name_offsets[i + 1]
+        return self._names_data[start:end].tobytes().decode("utf-8")
+
+    def entry(self, i: int) -> ImageEntry:
+        return ImageEntry(
+            int(self.ids[i]),
+            int(self.dataset_ids[i]),
+            self.name(i),
+            int(self.widths[i]),
+            int(self.heights[i]),
+        )
+
+    def find(self, image_id: int) -> Optional[ImageEntry]:
+        positions = np.flatnonzero(self.ids == image_id)
+        return self.entry(int(positions[0])) if len(positions) > 0 else None
+
+    def iter_entries(self, order: np.ndarray = None) -> Iterator[ImageEntry]:
+        order = np.arange(len(self)) if order is None else order
+        for i in order.tolist():
+            yield self.entry(i)
+
+    def iter_by_dataset(self) -> Iterator[ImageEntry]:
+        """Yields images grouped by dataset, in the original order within every dataset."""
+        return self.iter_entries(np.argsort(self.dataset_ids, kind="stable"))
+
+    def sizes(self) -> np.ndarray:
+        """Distinct (height, width) pairs."""
+        return np.unique(np.stack([self.heights, self.widths], axis=1), axis=0)
+
+    def save(self, path: str, updated_at: str):
+        np.savez(
+            path,
+            updated_at=np.array(str(updated_at)),
+            ids=self.ids,
+            dataset_ids=self.dataset_ids,
+            widths=self.widths,
+            heights=self.heights,
+            names_data=self._names_data,
+            name_offsets=self._name_offsets,
+        )
+
+    @classmethod
+    def load(cls, path: str, updated_at: str) -> Optional["ImagesTable"]:
+        """Returns None if the table was saved for another `updated_at`."""
+        with np.load(path, allow_pickle=False) as data:
+            if str(data["updated_at"]) != str(updated_at):
+                return None
+            return cls(
+                data["ids"],
+                data["dataset_ids"],
+                data["widths"],
+                data["heights"],
+                data["names_data"],
+                data["name_offsets"],
+            )
+
+
+class ProjectIndex:
+    """Images of the project, filled by a background thread while the app is already running.
+
+    `wait_any` returns as soon as at least one image is known, `wait_ready` when all datasets
+    are listed. Errors of the background thread are raised by both.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._chunks: List[ImagesTable] = []
+        self._any = threading.Event()
+        self._ready = threading.Event()
+        self._error = None
+
+    def extend(self, table: ImagesTable):
+        with self._lock:
+            self._chunks.append(table)
+        if len(table) > 0:
+            self._any.set()
+
+    def set_ready(self, error: Exception = None):
+        self._error = error
+        self._any.set()
+        self._ready.set()
+
+    @property
+    def is_ready(self) -> bool:
+        return self._ready.is_set()
+
+    def _raise_if_failed(self):
+        if self._error is not None:
+            raise RuntimeError(f"Can not list images of the project: {repr(self._error)}")
+
+    def wait_any(self):
+        self._any.wait()
+        self._raise_if_failed()
+
+    def wait_ready(self):
+        self._ready.wait()
+        self._raise_if_failed()
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(chunk) for chunk in self._chunks)
+
+    def table(self) -> ImagesTable:
+        """All images listed so far in one table."""
+        with self._lock:
+            table = ImagesTable.concatenate(self._chunks)
+            self._chunks = [table]
+            return table
+
+    def random_entry(self) -> ImageEntry:
+        table = self.table()
+        return table.entry(random.randrange(len(table)))
+
+
+def _get_cache_path(cache_dir: str, project_info) -> str:
+    return os.path.join(cache_dir, "images_index", f"{project_info.id}.npz")
+
+
+def _load_cache(path: str, project_info) -> Optional[ImagesTable]:
+    if not os.path.isfile(path):
+        return None
+    try:
+        return ImagesTable.load(path, project_info.updated_at)
+    except Exception as e:
+        sly.logger.warn(f"Can not read images index cache {path}: {repr(e)}")
+        return None
+
+
+def _save_cache(path: str, project_info, table: ImagesTable):
+    try:
+        sly.fs.ensure_base_path(path)
+        tmp_path = f"{path}.tmp.npz"
+        table.save(tmp_path, project_info.updated_at)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        sly.logger.warn(f"Can not save images index cache {path}: {repr(e)}")
+
+
+def _report_ready(on_ready: Callable[[int], None], count: int):
+    if on_ready is None:
+        return
+    try:
+        on_ready(count)
+    except Exception as e:
+        sly.logger.warn(f"Can not report indexing progress: {repr(e)}")
+
+
+def _fill_index(
+    index: ProjectIndex,
+    api: sly.Api,
+    project_info,
+    cache_dir: str,
+    workers_count: int,
+    progress: ProgressReporter,
+):
+    cache_path = _get_cache_path(cache_dir, project_info)
+    table = _load_cache(cache_path, project_info)
+    if table is not None:
+        sly.logger.info(f"Images index is loaded from cache: {len(table)} images")
+        index.extend(table)
+        if progress is not None:
+            progress.update(len(table))
+        return
+
+    datasets = get_project_datasets(api, project_info.id)
+    with ThreadPoolExecutor(max_workers=workers_count, thread_name_prefix="index") as executor:
+        futures = [executor.submit(api.image.get_list, dataset.id) for dataset in datasets]
+        for future in as_completed(futures):
+            # full ImageInfo objects are dropped right after the dataset is listed
+            table = ImagesTable.from_infos(future.result())
+            index.extend(table)
+            if progress is not None:
+                progress.update(len(table))
+    table = index.table()
+    _save_cache(cache_path, project_info, table)
+    sly.logger.info(f"Images index is built: {len(table)} images in {len(datasets)} datasets")
+
+
+def start_indexing(
+    index: ProjectIndex,
+    api: sly.Api,
+    project_info,
+    cache_dir: str,
+    workers_count: int,
+    progress: ProgressReporter = None,
+    on_ready: Callable[[int], None] = None,
+) -> ProjectIndex:
+    """Lists images of all datasets concurrently into the index in a background thread.
+
+    The index is cached on disk by project id and `updated_at`, so a reopened app starts instantly.
+    Listed images are counted by `progress`, `on_ready(images count)` is called at the end.
+    """
+
+    def _run():
+        error = None
+        try:
+            _fill_index(index, api, project_info, cache_dir, workers_count, progress)
+        except Exception as e:
+            sly.logger.error(f"Can not list images of the project: {repr(e)}", exc_info=True)
+            error = e
+        index.set_ready(error)
+        _report_ready(on_ready, len(index))
+
+    threading.Thread(target=_run, name="index", daemon=True).start()
+    return index
@@ -0,0 +1,62 @@
+from typing import Iterator, List, Tuple, Union
+
+import cv2
+import numpy as np
+import supervisely as sly
+from streaming import RawImage
+
+
+def get_scales(state: dict) -> List[float]:
+    """Pyramid levels selected in settings, from the largest one. Original size only by default."""
+    scales = sorted({float(scale) for scale in state["pyramidScales"] if 0 < scale <= 1})
+    return scales[::-1] or [1.0]
+
+
+def get_level_size(height: int, width: int, scale: float) -> Tuple[int, int]:
+    return max(1, round(height * scale)), max(1, round(width * scale))
+
+
+def get_scale_suffix(scale: float) -> str:
+    """Suffix of names of images and datasets of the pyramid level, empty for original size."""
+    return "" if scale == 1 else f"_x{scale:g}"
+
+
+def get_level_name(image_name: str, scale: float) -> str:
+    """Image name of the pyramid level, the suffix is placed before ___ of crop names."""
+    return "{}{}{}".format(
+        sly.fs.get_file_name(image_name), get_scale_suffix(scale), sly.fs.get_file_ext(image_name)
+    )
+
+
+def _remove_level(level: Union[np.ndarray, RawImage], img: Union[np.ndarray, RawImage]):
+    # the original image is removed by the caller
+    if level is not img and isinstance(level, RawImage):
+        level.remove()
+
+
+def iter_levels(
+    img: Union[np.ndarray, RawImage], ann: sly.Annotation, scales: List[float]
+) -> Iterator[Tuple[float, Union[np.ndarray, RawImage], sly.Annotation]]:
+    """Yields (scale, image, annotation) for every pyramid level, from the largest one.
+
+    Every level is downscaled from the previous one, so the image is decoded only once.
+    Levels of a huge image stay on disk as raw files and are cropped by bands like the original,
+    each of them is removed when the next level is built or the generator is closed.
+    """
+    height, width = img.shape[:2]
+    previous = img
+    try:
+        for scale in scales:
+            if scale == 1:
+                yield scale, img, ann
+                continue
+            size = get_level_size(height, width, scale)
+            if isinstance(previous, RawImage):
+                level = previous.write_resized(f"{img.path}_x{scale:g}", *size)
+            else:
+                level = cv2.resize(previous, (size[1], size[0]), interpolation=cv2.INTER_AREA)
+            _remove_level(previous, img)
+            previous = level
+            yield scale, level, ann.resize(size, skip_empty_masks=True)
+    finally:
+        _remove_level(previous, img)
@@ -0,0 +1,156 @@
+import cv2
+from labels_index import LabelsIndex
+import numpy as np
+import supervisely as sly
+
+LABELS_THICKNESS = 2
+WINDOW_THICKNESS = 3
+WINDOW_COLOR = [255, 0, 0]
+
+
+def pad_to_fixed_size(image, width: int, height: int):
+    image_height, image_width = image.shape[:2]
+    right_pad = max(width - image_width, 0)
+    bottom_pad = max(height - image_height, 0)
+    if right_pad == 0 and bottom_pad == 0:
+        return image
+    return cv2.copyMakeBorder(
+        image,
+        top=0,
+        bottom=bottom_pad,
+        left=0,
+        right=right_pad,
+        borderType=cv2.BORDER_CONSTANT,
+        value=(0, 0, 0),
+    )
+
+
+def select_frames(windows_count: int, max_frames: int) -> np.ndarray:
+    """Indices of windows shown in preview: all of them or evenly spread `max_frames` ones."""
+    if windows_count <= max_frames:
+        return np.arange(windows_count)
+    return np.unique(np.linspace(0, windows_count - 1, max_frames).round().astype(np.int64))
+
+
+def scale_windows(windows: np.ndarray, scale: float) -> np.ndarray:
+    """Scales inclusive (top, left, bottom, right) windows, every window keeps at least 1 pixel."""
+    if scale == 1:
+        return windows
+    scaled = np.empty_like(windows)
+    scaled[:, :2] = np.round(windows[:, :2] * scale)
+    scaled[:, 2:] = np.maximum(np.round((windows[:, 2:] + 1) * scale) - 1, scaled[:, :2])
+    return scaled
+
+
+class PreviewRenderer:
+    """Renders preview frames in preview space.
+
+    The image is downscaled to `max_height` and labels are drawn once; every frame is a copy of
+    the base image with the labels layer composited inside the window and the window rectangle.
+    With labels filtering, labels of every window are cropped and drawn in preview space.
+    Scaled annotation, labels layer and index are built on first use.
+    """
+
+    def __init__(
+        self,
+        img: np.ndarray,
+        ann: sly.Annotation,
+        windows: np.ndarray,
+        state: dict,
+        max_height: int,
+    ):
+        full_height = max(img.shape[0], int(windows[:, 2].max()) + 1)
+        full_width = max(img.shape[1], int(windows[:, 3].max()) + 1)
+        self.scale = min(1.0, max_height / full_height)
+        self.windows = scale_windows(windows, self.scale)
+
+        if self.scale < 1:
+            size = (
+                max(1, round(img.shape[1] * self.scale)),
+                max(1, round(img.shape[0] * self.scale)),
+            )
+            img = cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+        self.base = pad_to_fixed_size(
+            img,
+            width=max(round(full_width * self.scale), int(self.windows[:, 3].max()) + 1),
+            height=max(round(full_height * self.scale), int(self.windows[:, 2].max()) + 1),
+        )
+
+        self._ann = ann
+        self._preview_ann = None
+        self._draw_labels = state["drawLabels"] is True
+        self._clean_threshold = None
+        if state["cleanLabels"] is True:
+            self._clean_threshold = state["cleanLabelsThreshold"]
+        self._labels_layer = None
+        self._labels_index = None
+
+    @property
+    def preview_ann(self) -> sly.Annotation:
+        if self._preview_ann is None:
+            self._preview_ann = self._ann.scale(self.scale) if self.scale < 1 else self._ann
+        return self._preview_ann
+
+    @property
+    def labels_index(self) -> LabelsIndex:
+        if self._labels_index is None:
+            cell_size = max(self.windows[0, 2:] - self.windows[0, :2] + 1)
+            self._labels_index = LabelsIndex(self.preview_ann, cell_size=cell_size)
+        return self._labels_index
+
+    @property
+    def labels_layer(self) -> np.ndarray:
+        """Base image with all labels drawn."""
+        if self._labels_layer is None:
+            self._labels_layer = self.base.copy()
+            self.preview_ann.draw_pretty(self._labels_layer, thickness=LABELS_THICKNESS)
+        return self._labels_layer
+
+    @property
+    def frame_size(self):
+        """(width, height) of frames, as expected by cv2.VideoWriter."""
+        return self.base.shape[1], self.base.shape[0]
+
+    def draw_labels(self, frame: np.ndarray, window: np.ndarray):
+        top, left, bottom, right = window.tolist()
+        if self._clean_threshold is None:
+            region = self.labels_layer[top : bottom + 1, left : right + 1]
+            frame[top : bottom + 1, left : right + 1] = region
+        else:
+            # kept fragments differ from window to window
+            crop_ann = self.labels_index.relative_crop(
+                sly.Rectangle(top, left, bottom, right), min_area_percent=self._clean_threshold
+            )
+            region = frame[top : bottom + 1, left : right + 1].copy()
+            crop_ann.draw_pretty(region, thickness=LABELS_THICKNESS)
+            frame[top : bottom + 1, left : right + 1] = region
+
+    def count_labels(self, window_index: int) -> int:
+        """Number of labels in the window, after filtering by area if it is enabled."""
+        rect = sly.Rectangle(*self.windows[window_index].tolist())
+        if self._clean_threshold is None:
+            return len(self.labels_index.query(rect))
+        return len(self.labels_index.crop(rect, min_area_percent=self._clean_threshold))
+
+    def overview(self) -> np.ndarray:
+        """Single preview image: the base image with all labels if they are drawn."""
+        return self.labels_layer if self._draw_labels else self.base
+
+    def manifest(self, window_indices: np.ndarray) -> dict:
+        """Window rectangles of the overview image with label counts, stepped through by the GUI."""
+        return {
+            "width": self.base.shape[1],
+            "height": self.base.shape[0],
+            "windows": [
+                self.windows[i].tolist() + [self.count_labels(i)] for i in window_indices.tolist()
+            ],
+        }
+
+    def render(self, window_index: int) -> np.ndarray:
+        window = self.windows[window_index]
+        frame = self.base.copy()
+        if self._draw_labels:
+            self.draw_labels(frame, window)
+        top, left, bottom, right = window.tolist()
+        cv2.rectangle(frame, (left, top), (right, bottom), WINDOW_COLOR, WINDOW_THICKNESS)
+        return frame
@@ -0,0 +1,139 @@
+import os
+from typing import Callable, Iterator, Tuple
+
+import cv2
+import numpy as np
+import supervisely as sly
+import tifffile
+
+# only these files are decoded by segments, other formats are always decoded in memory
+STREAMED_EXTS = [".tif", ".tiff"]
+
+
+class RawImage:
+    """Decoded RGB image stored as a raw C-ordered uint8 file on local disk.
+
+    Rows are read through a memory map opened only for the requested band, so the resident memory
+    of the app is limited by the band size, not by the image size.
+    """
+
+    def __init__(self, path: str, height: int, width: int, channels: int):
+        self.path = path
+        self.height = height
+        self.width = width
+        self.channels = channels
+
+    @property
+    def shape(self) -> Tuple[int, int, int]:
+        return self.height, self.width, 3
+
+    def read_rows(self, top: int, bottom: int, out: np.ndarray = None) -> np.ndarray:
+        """Returns rows [top, bottom) as RGB image in memory, they are read into `out` if it is set."""
+        top, bottom = max(top, 0), min(bottom, self.height)
+        row_bytes = self.width * self.channels
+        band = np.memmap(
+            self.path,
+            dtype=np.uint8,
+            mode="r",
+            offset=top * row_bytes,
+            shape=(bottom - top, self.width, self.channels),
+        )
+        if out is None:
+            out = np.empty((bottom - top, self.width, 3), dtype=np.uint8)
+        # grayscale is broadcast to 3 channels, alpha is dropped
+        out[:] = band if self.channels == 1 else band[:, :, :3]
+        del band
+        return out
+
+    def _iter_resized_bands(self, height: int, width: int, band_height: int):
+        """Yields (top, bottom, rows) of the image resized to (height, width), band by band."""
+        for top in range(0, self.height, band_height):
+            bottom = min(top + band_height, self.height)
+            dst_top = round(top * height / self.height)
+            dst_bottom = min(round(bottom * height / self.height), height)
+            if dst_bottom <= dst_top:
+                continue
+            rows = cv2.resize(
+                self.read_rows(top, bottom),
+                (width, dst_bottom - dst_top),
+                interpolation=cv2.INTER_AREA,
+            )
+            yield dst_top, dst_bottom, rows
+
+    def read_scaled(self, scale: float, band_height: int = 1024) -> np.ndarray:
+        """Downscales the whole image band by band, only one band is decoded in memory."""
+        height = max(1, round(self.height * scale))
+        width = max(1, round(self.width * scale))
+        result = np.zeros((height, width, 3), dtype=np.uint8)
+        for top, bottom, rows in self._iter_resized_bands(height, width, band_height):
+            result[top:bottom] = rows
+        return result
+
+    def write_resized(
+        self, path: str, height: int, width: int, band_height: int = 1024
+    ) -> "RawImage":
+        """Downscales the image band by band into a new raw RGB file, nothing is kept in memory."""
+        result = np.memmap(path, dtype=np.uint8, mode="w+", shape=(height, width, 3))
+        for top, bottom, rows in self._iter_resized_bands(height, width, band_height):
+            result[top:bottom] = rows
+        result.flush()
+        del result
+        return RawImage(path, height, width, 3)
+
+    def remove(self):
+        sly.fs.silent_remove(self.path)
+
+
+def decode_to_raw(src_path: str, raw_path: str) -> RawImage:
+    """Decodes the TIFF file segment by segment straight into the memory-mapped raw file.
+
+    The whole image is never decoded in memory: images that can not be decoded this way
+    (not uint8, not a single grayscale or RGB(A) plane) raise RuntimeError.
+    """
+    with tifffile.TiffFile(src_path) as tif:
+        series = tif.series[0]
+        if series.dtype != np.uint8 or series.axes not in ["YX", "YXS"]:
+            raise RuntimeError(
+                f"Huge image {sly.fs.get_file_name_with_ext(src_path)} can not be streamed: "
+                f"only uint8 grayscale and RGB TIFF images are supported, "
+                f"got {series.dtype} with axes {series.axes}. Disable streaming of huge images."
+            )
+        tif.asarray(series=0, out=raw_path)
+        channels = series.shape[2] if series.axes == "YXS" else 1
+        return RawImage(raw_path, series.shape[0], series.shape[1], channels)
+
+
+def download_raw(api: sly.Api, image_info, dir_path: str) -> RawImage:
+    """Downloads the original image file to local disk once and decodes it to a raw file."""
+    src_path = os.path.join(dir_path, f"{image_info.id}{sly.fs.get_file_ext(image_info.name)}")
+    sly.fs.ensure_base_path(src_path)
+    api.image.download_path(image_info.id, src_path)
+    try:
+        return decode_to_raw(src_path, os.path.join(dir_path, f"{image_info.id}.raw"))
+    finally:
+        sly.fs.silent_remove(src_path)
+
+
+def is_streamed(image_info, state: dict, min_pixels: int) -> bool:
+    """Huge TIFF images are streamed if it is enabled, other images are decoded in memory."""
+    if state["streamLargeImages"] is not True:
+        return False
+    if sly.fs.get_file_ext(image_info.name).lower() not in STREAMED_EXTS:
+        return False
+    return (image_info.width or 0) * (image_info.height or 0) >= min_pixels
+
+
+def iter_bands(
+    raw: RawImage, windows: np.ndarray, empty: Callable[[Tuple[int, int, int]], np.ndarray] = None
+) -> Iterator[Tuple[int, np.ndarray, np.ndarray]]:
+    """Yields (band top, band rows, windows of the band) for every row of windows.
+
+    A band is one window height tall (overlap with the next row is read again), windows keep
+    coordinates of the full image. Rows are read into arrays allocated by `empty` if it is set.
+    """
+    tops = windows[:, 0]
+    for top in np.unique(tops).tolist():
+        band_windows = windows[tops == top]
+        bottom = min(int(band_windows[:, 2].max()) + 1, raw.height)
+        out = None if empty is None else empty((bottom - top, raw.width, 3))
+        yield top, raw.read_rows(top, bottom, out=out), band_windows
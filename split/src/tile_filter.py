@@ -0,0 +1,29 @@
+import zlib
+
+import cv2
+import numpy as np
+
+
+def get_empty_keep_mask(image_name: str, windows_count: int, state: dict) -> np.ndarray:
+    """Which windows of the image are kept if they have no labels.
+
+    Decision depends only on the window index in the full image, so all shards and bands of
+    the image agree. Random sampling is seeded by the image name and is reproducible.
+    """
+    policy = state["emptyTiles"]
+    if policy == "keep":
+        return np.ones(windows_count, dtype=bool)
+    fraction = state["emptyTilesPercent"] / 100
+    if policy == "drop" or fraction <= 0:
+        return np.zeros(windows_count, dtype=bool)
+    if policy == "random":
+        rng = np.random.default_rng(zlib.crc32(image_name.encode("utf-8")))
+        return rng.random(windows_count) < fraction
+    stride = max(1, round(1 / fraction))
+    return np.arange(windows_count) % stride == 0
+
+
+def is_uniform(image: np.ndarray, max_std: float) -> bool:
+    """True for flat regions like black padding or nodata: std of every channel is below limit."""
+    _, std = cv2.meanStdDev(image)
+    return float(std.max()) <= max_std
@@ -0,0 +1,70 @@
+from typing import List, Tuple
+
+import cv2
+import numpy as np
+import supervisely as sly
+
+
+def crop_window(img: np.ndarray, window: np.ndarray) -> np.ndarray:
+    """Returns the window of the image without copying pixels.
+
+    Only windows that go beyond the image (add_padding border strategy) are copied
+    into a zero-padded buffer of the window size.
+    """
+    top, left, bottom, right = window.tolist()
+    height, width = img.shape[:2]
+    if bottom < height and right < width:
+        return img[top : bottom + 1, left : right + 1]
+
+    tile = np.zeros((bottom - top + 1, right - left + 1) + img.shape[2:], dtype=img.dtype)
+    part = img[top : bottom + 1, left : right + 1]
+    tile[: part.shape[0], : part.shape[1]] = part
+    return tile
+
+
+def get_resized_size(height: int, width: int, target_height: int) -> Tuple[int, int]:
+    """Size of the image resized by height with kept aspect ratio."""
+    if height == target_height:
+        return height, width
+    return target_height, max(1, round(width * target_height / height))
+
+
+def resize_tile(image: np.ndarray, size: Tuple[int, int]) -> np.ndarray:
+    """Resizes the image (or a view of it) to (height, width), without copying the view first.
+
+    The image is returned as is if it already has this size.
+    """
+    if image.shape[:2] == tuple(size):
+        return image
+    return cv2.resize(image, (size[1], size[0]), interpolation=cv2.INTER_LINEAR)
+
+
+def get_tile_ext(image_name: str, state: dict) -> str:
+    """Extension of output tiles: same as the source image or the codec selected in settings."""
+    if state["tileCodec"] == "jpeg":
+        return ".jpg"
+    if state["tileCodec"] == "png":
+        return ".png"
+    if state["tileCodec"] == "webp":
+        return ".webp"
+    return sly.fs.get_file_ext(image_name)
+
+
+def get_encode_params(state: dict) -> List[int]:
+    if state["tileCodec"] == "jpeg":
+        return [cv2.IMWRITE_JPEG_QUALITY, int(state["jpegQuality"])]
+    if state["tileCodec"] == "png":
+        return [cv2.IMWRITE_PNG_COMPRESSION, int(state["pngCompression"])]
+    if state["tileCodec"] == "webp":
+        return [cv2.IMWRITE_WEBP_QUALITY, int(state["webpQuality"])]
+    return []
+
+
+def encode_tile(image: np.ndarray, ext: str, params: List[int]) -> bytes:
+    """Encodes RGB tile like sly.image.write_bytes, with codec parameters."""
+    if image.ndim == 3:
+        image = cv2.cvtColor(image.astype(np.uint8, copy=False), cv2.COLOR_RGB2BGR)
+    encode_status, img_array = cv2.imencode(ext, image, params)
+    if encode_status is True:
+        return img_array.tobytes()
+    raise RuntimeError("Can not encode input image")
@@ -0,0 +1,80 @@
+import io
+import os
+import tempfile
+from typing import Callable, Dict, List
+
+import supervisely as sly
+
+
+def upload_encoded(api: sly.Api, dataset_id: int, names: List[str], blobs: List[bytes]):
+    """Uploads already encoded images, like api.image.upload_nps but without encoding them twice."""
+    # api.image._upload_data_bulk is private: written against supervisely 6.74.49, while the app
+    # docker image pins 6.73.571. If it is missing, encoded images are uploaded from temp files
+    if not hasattr(api.image, "_upload_data_bulk"):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            paths = []
+            for i, (name, data) in enumerate(zip(names, blobs)):
+                paths.append(os.path.join(tmp_dir, f"{i}{sly.fs.get_file_ext(name)}"))
+                with open(paths[-1], "wb") as f:
+                    f.write(data)
+            return api.image.upload_paths(dataset_id, names, paths)
+    hashes = [sly.fs.get_bytes_hash(data) for data in blobs]
+    api.image._upload_data_bulk(lambda data: io.BytesIO(data), zip(blobs, hashes))
+    return api.image.upload_hashes(dataset_id, names, hashes)
+
+
+class _PendingBatch:
+    def __init__(self):
+        self.names = []
+        self.blobs = []
+        self.anns = []
+        self.bytes = 0
+
+
+class UploadAccumulator:
+    """Collects tiles of many source images per destination dataset and uploads them in batches.
+
+    A batch is flushed when it reaches `max_items` tiles or `max_bytes` of encoded image data, so
+    small images do not produce thousands of tiny requests and huge images are split into several ones.
+    """
+
+    def __init__(
+        self,
+        api: sly.Api,
+        max_items: int,
+        max_bytes: int,
+        on_uploaded: Callable[[int], None] = None,
+    ):
+        self._api = api
+        self._max_items = max_items
+        self._max_bytes = max_bytes
+        self._on_uploaded = on_uploaded
+        self._pending: Dict[int, _PendingBatch] = {}
+
+    def add(self, dataset_id: int, names: List[str], blobs: List[bytes], anns: List[dict]):
+        """Adds encoded tiles with annotations json."""
+        for name, data, ann in zip(names, blobs, anns):
+            batch = self._pending.setdefault(dataset_id, _PendingBatch())
+            if len(batch.names) > 0 and (
+                len(batch.names) >= self._max_items or batch.bytes + len(data) > self._max_bytes
+            ):
+                self._flush(dataset_id)
+                batch = self._pending.setdefault(dataset_id, _PendingBatch())
+            batch.names.append(name)
+            batch.blobs.append(data)
+            batch.anns.append(ann)
+            batch.bytes += len(data)
+
+    def flush(self):
+        for dataset_id in list(self._pending.keys()):
+            self._flush(dataset_id)
+
+    def _flush(self, dataset_id: int):
+        batch = self._pending.pop(dataset_id, None)
+        if batch is None or len(batch.names) == 0:
+            return
+        dst_image_infos = upload_encoded(self._api, dataset_id, batch.names, batch.blobs)
+        dst_image_ids = [dst_img_info.id for dst_img_info in dst_image_infos]
+        self._api.annotation.upload_jsons(dst_image_ids, batch.anns)
+        if self._on_uploaded is not None:
+            self._on_uploaded(len(batch.names))
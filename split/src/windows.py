@@ -0,0 +1,159 @@
+import math
+from functools import lru_cache
+from numbers import Integral
+from typing import List, Tuple
+
+import numpy as np
+import supervisely as sly
+from supervisely.geometry.sliding_windows_fuzzy import SlidingWindowBorderStrategy
+
+
+def get_sliding_windows_sizes(height: int, width: int, state: dict) -> Tuple[int, int, int, int]:
+    """Returns (window height, window width, overlap y, overlap x) for the image of the given size.
+
+    Window is limited by the image size. State is not modified.
+    """
+    if state["usePercents"] is True:
+        w_height = math.ceil(height * state["windowHeightPercent"] / 100)
+        overlap_y = math.ceil(w_height * state["overlapYPercent"] / 100)
+        if state["useSquare"] is True:
+            w_width = w_height
+            overlap_x = overlap_y
+        else:
+            w_width = math.ceil(width * state["windowWidthPercent"] / 100)
+            overlap_x = math.ceil(w_width * state["overlapXPercent"] / 100)
+    else:
+        w_height = state["windowHeightPx"]
+        w_width = state["windowWidthPx"] if state["useSquare"] is False else w_height
+        overlap_y = state["overlapYPx"]
+        overlap_x = state["overlapXPx"] if state["useSquare"] is False else overlap_y
+
+    return min(w_height, height), min(w_width, width), overlap_y, overlap_x
+
+
+@lru_cache(maxsize=1024)
+def _plan_windows(
+    height: int,
+    width: int,
+    window_height: int,
+    window_width: int,
+    overlap_y: int,
+    overlap_x: int,
+    border_strategy: str,
+) -> np.ndarray:
+    # same grid and errors as supervisely SlidingWindowsFuzzy
+    if not all(isinstance(v, Integral) for v in (window_height, window_width)):
+        raise ValueError("window_shape must contains 2 integers.")
+    if not all(isinstance(v, Integral) for v in (overlap_y, overlap_x)):
+        raise ValueError("min_overlap must contains 2 integers.")
+    stride_y = window_height - overlap_y
+    stride_x = window_width - overlap_x
+    if min(stride_y, stride_x) < 1:
+        raise RuntimeError("Wrong sliding window settings, overlap is too high.")
+    if not SlidingWindowBorderStrategy.has_value(border_strategy):
+        raise ValueError(
+            "Unknown strategy {!r}. Allowed strategies: {}".format(
+                border_strategy, SlidingWindowBorderStrategy.values()
+            )
+        )
+    if window_height > height or window_width > width:
+        raise RuntimeError("Sliding window: window is larger than source (image).")
+
+    if border_strategy == str(SlidingWindowBorderStrategy.SHIFT_WINDOW):
+        limit_y, limit_x = height - window_height, width - window_width
+        tops = np.minimum(np.arange(0, limit_y + stride_y, stride_y), limit_y)
+        lefts = np.minimum(np.arange(0, limit_x + stride_x, stride_x), limit_x)
+        bottoms = tops + window_height - 1
+        rights = lefts + window_width - 1
+    elif border_strategy == str(SlidingWindowBorderStrategy.ADD_PADDING):
+        tops = np.arange(0, height, stride_y)
+        lefts = np.arange(0, width, stride_x)
+        bottoms = tops + window_height - 1
+        rights = lefts + window_width - 1
+    else:
+        tops = np.arange(0, height, stride_y)
+        lefts = np.arange(0, width, stride_x)
+        bottoms = np.minimum(tops + stride_y, height) - 1
+        rights = np.minimum(lefts + stride_x, width) - 1
+
+    # row-major order, same as SlidingWindowsFuzzy.get
+    windows = np.empty((len(tops) * len(lefts), 4), dtype=np.int64)
+    windows[:, 0] = np.repeat(tops, len(lefts))
+    windows[:, 1] = np.tile(lefts, len(tops))
+    windows[:, 2] = np.repeat(bottoms, len(lefts))
+    windows[:, 3] = np.tile(rights, len(tops))
+    windows.flags.writeable = False
+    return windows
+
+
+def plan_windows(height: int, width: int, state: dict) -> np.ndarray:
+    """Returns sliding windows for the image of the given size as array of (top, left, bottom, right).
+
+    Bounds are inclusive, like in sly.Rectangle. Grids are memoized per image size and settings,
+    the returned array is read-only.
+    """
+    window_height, window_width, overlap_y, overlap_x = get_sliding_windows_sizes(
+        height, width, state
+    )
+    return _plan_windows(
+        int(height),
+        int(width),
+        window_height,
+        window_width,
+        overlap_y,
+        overlap_x,
+        state["borderStrategy"],
+    )
+
+
+def to_rectangle(window: np.ndarray) -> sly.Rectangle:
+    top, left, bottom, right = window.tolist()
+    return sly.Rectangle(top, left, bottom, right)
+
+
+def _get_base_name(image_name: str, ext: str = None) -> str:
+    safe_base_name = sly.fs.get_file_name(image_name).replace("___", "__")
+    src_ext = sly.fs.get_file_ext(image_name)
+    # a.png and a.tif of one dataset would get the same crops if the codec changes extensions,
+    # so the source extension is kept in the name: a_png___0001_0_224.jpg
+    if ext is not None and src_ext != "" and ext.lower() != src_ext.lower():
+        safe_base_name = "{}_{}".format(safe_base_name, src_ext[1:])
+    return safe_base_name
+
+
+def get_merged_name(image_name: str, ext: str = None) -> str:
+    """Name of the image restored by the merge app from crops of this image."""
+    return _get_base_name(image_name, ext) + (ext or sly.fs.get_file_ext(image_name))
+
+
+def get_crop_names(
+    image_name: str,
+    windows: np.ndarray,
+    height: int,
+    width: int,
+    ext: str = None,
+    indices: np.ndarray = None,
+    add_dims: bool = True,
+) -> List[str]:
+    """Names of crops in the format parsed by the merge app.
+
+    The first crop also keeps original image dimensions: <name>___0000_<top>_<left>_dims_<h>x<w><ext>
+    Extension of the source image is used if `ext` is not set. `indices` are window indices in
+    the full grid if only some windows are kept, sequential by default. Without `add_dims` no name
+    has dimensions, for crops named after the first crop of the image. If `ext` differs from the
+    source extension, the source one is kept in the name: <name>_<source ext>___0000_...<ext>
+    """
+    safe_base_name = _get_base_name(image_name, ext)
+    ext = ext or sly.fs.get_file_ext(image_name)
+    if indices is None:
+        indices = np.arange(len(windows))
+    names = [
+        "{}___{:04d}_{}_{}{}".format(safe_base_name, window_index, top, left, ext)
+        for window_index, (top, left) in zip(indices.tolist(), windows[:, :2].tolist())
+    ]
+    if add_dims and len(names) > 0:
+        top, left = windows[0, :2].tolist()
+        names[0] = "{}___{:04d}_{}_{}_dims_{}x{}{}".format(
+            safe_base_name, int(indices[0]), top, left, height, width, ext
+        )
+    return names
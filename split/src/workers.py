@@ -0,0 +1,273 @@
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, wait
+from multiprocessing import resource_tracker, shared_memory
+from typing import Dict, List, Tuple
+
+from labels_index import LabelsIndex
+import numpy as np
+import supervisely as sly
+from tiles import (
+    crop_window,
+    encode_tile,
+    get_encode_params,
+    get_resized_size,
+    get_tile_ext,
+    resize_tile,
+)
+from tile_filter import is_uniform
+from windows import to_rectangle
+
+
+def crop_image_windows(
+    image_name: str,
+    img: np.ndarray,
+    ann: sly.Annotation,
+    windows: np.ndarray,
+    state: dict,
+    row_offset: int = 0,
+    keep_empty: np.ndarray = None,
+) -> Tuple[List[np.ndarray], List[sly.Annotation], np.ndarray]:
+    """Crops windows of the image and its annotation.
+
+    `img` may be a horizontal band of the image that starts at `row_offset`, windows and
+    annotation are in coordinates of the full image. Windows without labels are skipped if they
+    are not marked in `keep_empty` or are uniform (with skipUniformTiles). Returns crops of kept
+    windows and the mask of kept windows.
+    """
+    # areas of source labels are computed once by the index, each window is cropped once
+    labels_index = LabelsIndex(ann, cell_size=max(windows[0, 2:] - windows[0, :2] + 1))
+    clean_threshold = state["cleanLabelsThreshold"] if state["cleanLabels"] is True else None
+    skip_uniform = state["skipUniformTiles"] is True
+    crop_images = []
+    crop_anns = []
+    kept = np.ones(len(windows), dtype=bool)
+
+    for window_index, window in enumerate(windows):
+        crop_ann = labels_index.relative_crop(
+            to_rectangle(window), min_area_percent=clean_threshold
+        )
+        # view of the decoded image, only border windows with padding are copied
+        crop_image = crop_window(img, window - (row_offset, 0, row_offset, 0))
+        if len(crop_ann.labels) == 0 and (
+            (keep_empty is not None and not keep_empty[window_index])
+            or (skip_uniform and is_uniform(crop_image, state["uniformTilesMaxStd"]))
+        ):
+            kept[window_index] = False
+            continue
+        if state["resizeWindow"] is True:
+            resized_size = get_resized_size(
+                crop_image.shape[0], crop_image.shape[1], state["resizeValue"]
+            )
+            try:
+                crop_ann, crop_image = (
+                    crop_ann.resize(resized_size),
+                    resize_tile(crop_image, resized_size),
+                )
+            except Exception as e:
+                sly.logger.warn(f"Can not resize {image_name} image and annotations.")
+        crop_images.append(crop_image)
+        crop_anns.append(crop_ann)
+
+    return crop_images, crop_anns, kept
+
+
+def process_windows(
+    image_name: str,
+    img: np.ndarray,
+    ann: sly.Annotation,
+    windows: np.ndarray,
+    state: dict,
+    encode_map=map,
+    row_offset: int = 0,
+    keep_empty: np.ndarray = None,
+) -> Tuple[List[bytes], List[dict], np.ndarray]:
+    """Crops windows of the image and its annotation.
+
+    Returns encoded tiles and annotations json of kept windows and the mask of kept windows.
+    """
+    crop_images, crop_anns, kept = crop_image_windows(
+        image_name, img, ann, windows, state, row_offset, keep_empty
+    )
+    ext = get_tile_ext(image_name, state)
+    encode_params = get_encode_params(state)
+    crop_blobs = list(
+        encode_map(lambda crop_image: encode_tile(crop_image, ext, encode_params), crop_images)
+    )
+    return crop_blobs, [crop_ann.to_json() for crop_ann in crop_anns], kept
+
+
+_worker_meta: sly.ProjectMeta = None
+
+
+def _init_worker(meta_json: dict):
+    global _worker_meta
+    _worker_meta = sly.ProjectMeta.from_json(meta_json)
+
+
+def _process_shard(
+    shm_name, shape, dtype, image_name, ann_json, windows, state, row_offset, keep_empty
+):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    img = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    try:
+        ann = sly.Annotation.from_json(ann_json, _worker_meta)
+        return process_windows(
+            image_name, img, ann, windows, state, row_offset=row_offset, keep_empty=keep_empty
+        )
+    finally:
+        del img
+        try:
+            shm.close()
+        except BufferError:
+            pass  # views of the shared buffer are still referenced by the raised exception
+
+
+def _try_close(shm: shared_memory.SharedMemory) -> bool:
+    try:
+        shm.close()
+        return True
+    except BufferError:
+        return False  # views of the segment are still referenced
+
+
+def get_label_bboxes(ann: sly.Annotation) -> np.ndarray:
+    """Bboxes of labels as array of (top, left, bottom, right) rows."""
+    bboxes = np.zeros((len(ann.labels), 4), dtype=np.int64)
+    for i, label in enumerate(ann.labels):
+        bbox = label.geometry.to_bbox()
+        bboxes[i] = bbox.top, bbox.left, bbox.bottom, bbox.right
+    return bboxes
+
+
+def filter_labels(ann: sly.Annotation, bboxes: np.ndarray, windows: np.ndarray) -> sly.Annotation:
+    """Annotation with only the labels that intersect the bounding box of the windows."""
+    top, left = windows[:, :2].min(axis=0).tolist()
+    bottom, right = windows[:, 2:].max(axis=0).tolist()
+    inside = (
+        (bboxes[:, 0] <= bottom)
+        & (bboxes[:, 2] >= top)
+        & (bboxes[:, 1] <= right)
+        & (bboxes[:, 3] >= left)
+    )
+    return ann.clone(labels=[ann.labels[i] for i in np.flatnonzero(inside).tolist()])
+
+
+class SharedMemoryPool:
+    """Shards windows of every image across worker processes.
+
+    Images are decoded or read straight into shared memory by `share` and `empty`, other images
+    are copied into a temporary segment. Workers crop, resize and encode their shard of windows
+    and return encoded tiles with annotations json.
+    """
+
+    def __init__(self, workers_count: int, meta: sly.ProjectMeta):
+        self._workers_count = workers_count
+        # arrays allocated in shared memory by id, they are kept alive until released
+        self._segments: Dict[int, Tuple[shared_memory.SharedMemory, np.ndarray]] = {}
+        # released segments that are still referenced by views of the caller
+        self._unmapped: List[shared_memory.SharedMemory] = []
+        self._lock = threading.Lock()
+        # forked workers share the tracker of the app process, so segments are tracked only once
+        resource_tracker.ensure_running()
+        # workers are forked: the app module can not be re-imported in a spawned process
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers_count,
+            mp_context=multiprocessing.get_context("fork"),
+            initializer=_init_worker,
+            initargs=(meta.to_json(),),
+        )
+        # fork all processes now: the pool should be created before threads of the caller start
+        self._executor.submit(int).result()
+
+    def empty(self, shape: Tuple[int, ...], dtype=np.uint8) -> np.ndarray:
+        """Array in a new shared memory segment, it is processed without a copy until released."""
+        size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        img = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        self._segments[id(img)] = (shm, img)
+        return img
+
+    def share(self, img: np.ndarray) -> np.ndarray:
+        """Moves the image into shared memory, the caller should drop the original."""
+        shared_img = self.empty(img.shape, img.dtype)
+        shared_img[:] = img
+        return shared_img
+
+    def release(self, img: np.ndarray):
+        """Frees the segment of the array allocated by `empty` or `share`, other arrays are ignored.
+
+        The segment is unlinked at once and unmapped when views of it are not referenced anymore.
+        """
+        with self._lock:
+            segment = self._segments.pop(id(img), None)
+            if segment is not None:
+                shm = segment[0]
+                del segment
+                shm.unlink()
+                self._unmapped.append(shm)
+            self._unmapped = [shm for shm in self._unmapped if not _try_close(shm)]
+
+    def process(
+        self,
+        image_name: str,
+        img: np.ndarray,
+        ann: sly.Annotation,
+        windows: np.ndarray,
+        state: dict,
+        row_offset: int = 0,
+        keep_empty: np.ndarray = None,
+    ) -> Tuple[List[bytes], List[dict], np.ndarray]:
+        shared_img = img
+        if id(img) not in self._segments:
+            # images that were not allocated by the pool, like pyramid levels, are copied once
+            shared_img = self.share(img)
+        shm = self._segments[id(shared_img)][0]
+        futures = []
+        try:
+            shards_count = min(self._workers_count, len(windows))
+            if keep_empty is None:
+                keep_empty = np.ones(len(windows), dtype=bool)
+            # workers get only the labels of their shard, not the whole annotation
+            bboxes = get_label_bboxes(ann)
+            shards = zip(
+                np.array_split(windows, shards_count), np.array_split(keep_empty, shards_count)
+            )
+            for shard, shard_keep_empty in shards:
+                futures.append(
+                    self._executor.submit(
+                        _process_shard,
+                        shm.name,
+                        img.shape,
+                        img.dtype.str,
+                        image_name,
+                        filter_labels(ann, bboxes, shard).to_json(),
+                        shard,
+                        state,
+                        row_offset,
+                        shard_keep_empty,
+                    )
+                )
+            crop_blobs, crop_anns, kept = [], [], []
+            for future in futures:
+                shard_blobs, shard_anns, shard_kept = future.result()
+                crop_blobs.extend(shard_blobs)
+                crop_anns.extend(shard_anns)
+                kept.append(shard_kept)
+            return crop_blobs, crop_anns, np.concatenate(kept)
+        finally:
+            wait(futures)
+            if shared_img is not img:
+                self.release(shared_img)
+
+    def shutdown(self):
+        self._executor.shutdown(cancel_futures=True)
+        # segments of images that were not processed because of an error
+        for img_id in list(self._segments.keys()):
+            self.release(self._segments[img_id][1])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()